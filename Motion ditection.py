@@ -1,15 +1,22 @@
-import cv2
 import numpy as np
 import pygame
 import threading
-import smtplib
+import queue
 import time
 import os
 import json
 import logging
-from email.mime.multipart import MIMEMultipart
-from email.mime.application import MIMEApplication
-from email.mime.text import MIMEText
+
+from motion_engine import (MotionDetector, DETECTOR_CONFIG_KEYS, RECORD_CODECS, VIDEO_EXTENSIONS,
+                           detector_options, clip_timestamps_path, read_clip_timestamps)
+from camera_supervisor import CameraSupervisor
+from alert_dispatcher import AlertDispatcher
+from mailer import SMTPSession, build_alert_message, build_digest_message, permanent_failure
+from email_log import open_email_log, close_email_logs
+from clip_index import ClipFrameReader, clip_frame_index_path
+from event_index import open_event_index, close_event_indexes
+from media_watcher import MediaFolderWatcher
+from thumbnail_cache import open_thumbnail_cache, close_thumbnail_caches, read_reduced
 
 import kivy
 from kivy.app import App
@@ -29,7 +36,7 @@ from kivy.properties import StringProperty, NumericProperty
 from kivy.core.window import Window
 from kivy.animation import Animation
 from kivy.metrics import dp
-from kivy.graphics import Color, Rectangle, RoundedRectangle
+from kivy.graphics import Color, Rectangle, RoundedRectangle, Line
 from kivy.clock import Clock
 from kivy.graphics.texture import Texture
 from kivy.uix.spinner import Spinner
@@ -99,6 +106,11 @@ Builder.load_string('''
             pos: self.pos
             size: self.size
             radius: [10]
+    AsyncImage:
+        source: root.thumbnail
+        size_hint_x: None
+        width: dp(60)
+        opacity: 1 if root.thumbnail else 0
     Label:
         text: root.text
         markup: True
@@ -231,7 +243,7 @@ def get_user_email_log_file():
     user_folder = os.path.join("users_data", current_user)
     if not os.path.exists(user_folder):
         os.makedirs(user_folder)
-    return os.path.join(user_folder, "email_log.json")
+    return os.path.join(user_folder, "email_log.jsonl")
 
 # -----------------------------------------------------------------------------
 # Custom HoverButton with theming and drop shadow
@@ -317,11 +329,6 @@ pygame.mixer.init()
 # Global Variables & Configuration
 # -----------------------------------------------------------------------------
 sound_playing = False
-motion_detected = False
-last_email_sent_time = 0
-recording = False
-sensitivity = 500  
-stop_detection = False
 users = {}
 current_user = None
 default_subject = "Motion Detected"
@@ -334,6 +341,7 @@ password = "rxqz bofx xwic mejw"  # Replace with your actual app-specific passwo
 
 USER_DATA_FILE = "users.json"
 CONFIG_FILE = "config.json"
+ALERT_QUEUE_FILE = "alert_queue.json"
 
 def initialize_users():
     global users
@@ -398,64 +406,6 @@ else:
 logging.basicConfig(filename='motion_detection.log', level=logging.DEBUG,
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
-# -----------------------------------------------------------------------------
-# Custom OpenCV-based Video Player Class (CVVideoPlayer)
-# -----------------------------------------------------------------------------
-class CVVideoPlayer(BoxLayout):
-    def __init__(self, video_path, **kwargs):
-        super().__init__(**kwargs)
-        self.orientation = 'vertical'
-        self.video_path = video_path
-        self.playing = False
-        self.capture = cv2.VideoCapture(video_path)
-        if not self.capture.isOpened():
-            self.add_widget(Label(text="Error: Unable to open video file", color=(1,0,0,1)))
-            return
-        # Get total frames and fps for seeking
-        self.total_frames = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT))
-        self.fps = self.capture.get(cv2.CAP_PROP_FPS)
-        if self.fps <= 0:
-            self.fps = 30
-        self.current_frame = 0
-        self.image_widget = Image()
-        self.add_widget(self.image_widget)
-        self._update_event = None
-
-    def start(self):
-        if not self.playing:
-            self.playing = True
-            self._update_event = Clock.schedule_interval(self.update, 1.0 / self.fps)
-
-    def pause(self):
-        if self.playing:
-            self.playing = False
-            if self._update_event:
-                Clock.unschedule(self._update_event)
-                self._update_event = None
-
-    def stop(self):
-        self.pause()
-        if self.capture and self.capture.isOpened():
-            self.capture.release()
-
-    def update(self, dt):
-        ret, frame = self.capture.read()
-        if ret:
-            self.current_frame = int(self.capture.get(cv2.CAP_PROP_POS_FRAMES))
-            # Convert BGR to RGB and update texture
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            texture = Texture.create(size=(frame.shape[1], frame.shape[0]), colorfmt='rgb')
-            texture.blit_buffer(frame.tobytes(), colorfmt='rgb', bufferfmt='ubyte')
-            texture.flip_vertical()
-            self.image_widget.texture = texture
-        else:
-            self.stop()
-
-    def seek(self, frame_index):
-        if self.capture and self.capture.isOpened():
-            self.capture.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
-            self.current_frame = frame_index
-
 # -----------------------------------------------------------------------------
 # Core Functions
 # -----------------------------------------------------------------------------
@@ -473,173 +423,289 @@ def stop_alert_sound():
     sound_playing = False
 
 def send_email_alert(video_path=None, image_path=None):
-    global last_email_sent_time, receiver_email, default_subject, default_body, password
-    current_time = time.time()
-    if current_time - last_email_sent_time >= 20:
-        msg = MIMEMultipart()
-        msg["Subject"] = default_subject
-        msg["From"] = sender_email
-        msg["To"] = receiver_email
-        body = MIMEText(default_body)
-        msg.attach(body)
-        if video_path and os.path.exists(video_path):
-            with open(video_path, 'rb') as f:
-                video_attachment = MIMEApplication(f.read(), _subtype="avi")
-                video_attachment.add_header('Content-Disposition', 'attachment', filename=os.path.basename(video_path))
-                msg.attach(video_attachment)
-        if image_path and os.path.exists(image_path):
-            with open(image_path, 'rb') as f:
-                image_attachment = MIMEApplication(f.read(), _subtype="jpg")
-                image_attachment.add_header('Content-Disposition', 'attachment', filename=os.path.basename(image_path))
-                msg.attach(image_attachment)
+    # Only queues the alert; alert_dispatcher sends it from its own thread.
+    alert_dispatcher.submit(to=receiver_email, subject=default_subject, body=default_body,
+                            video_path=video_path, image_path=image_path,
+                            log_file=get_user_email_log_file())
+
+def log_sent_email(alert, subject, bytes_saved=0):
+    try:
+        # Alerts queued by older versions still name email_log.json; the log
+        # maps that to the .jsonl file next to it.
+        open_email_log(alert['log_file']).append({
+            'to': alert['to'],
+            'subject': subject,
+            'body': alert['body'],
+            'time': time.strftime("%Y-%m-%d %H:%M:%S"),
+            'video': os.path.basename(alert['video_path']) if alert.get('video_path') else None,
+            'image': os.path.basename(alert['image_path']) if alert.get('image_path') else None,
+            'bytes_saved': bytes_saved
+        })
+    except Exception as e:
+        # The mail is out; a log failure must not make the dispatcher resend it.
+        logging.error("Error writing email log: %s", e)
+
+def deliver_email_alerts(alerts):
+    # Runs on the dispatcher thread; raising makes the dispatcher retry later.
+    # More than one alert means a digest: one message per recipient.
+    if not password and config.get('smtp_auth', True):
+        raise ValueError("Email password not set.")
+    recipients = {}
+    for alert in alerts:
+        recipients.setdefault(alert['to'], []).append(alert)
+    # Clips over the budget are swapped for a contact sheet or a downscaled copy.
+    budget = config.get('email_attachment_budget_mb', 18) * 1e6
+    for to, batch in recipients.items():
+        if len(batch) > 1:
+            msg = build_digest_message(sender_email, batch)
+        else:
+            msg = build_alert_message(sender_email, batch[0], budget, config.get('oversize_clip', 'contact_sheet'))
         try:
-            if not password:
-                raise ValueError("Email password not set.")
-            with smtplib.SMTP_SSL("smtp.gmail.com", 465) as server:
-                server.login(sender_email, password)
-                server.sendmail(sender_email, receiver_email, msg.as_string())
-            print("Email sent successfully!")
-            logging.info("Email sent successfully to %s", receiver_email)
-            last_email_sent_time = current_time
-            email_log_file = get_user_email_log_file()
-            email_log = []
-            if os.path.exists(email_log_file):
-                with open(email_log_file, "r") as file:
-                    email_log = json.load(file)
-            email_log.append({
-                'to': receiver_email,
-                'subject': default_subject,
-                'body': default_body,
-                'time': time.strftime("%Y-%m-%d %H:%M:%S"),
-                'video': os.path.basename(video_path) if video_path else None,
-                'image': os.path.basename(image_path) if image_path else None
-            })
-            with open(email_log_file, "w") as file:
-                json.dump(email_log, file)
-        except Exception as e:
-            print(f"Error sending email: {e}")
-            logging.error("Error sending email: %s", e)
-
-def motion_detection():
-    global sound_playing, motion_detected, recording, sensitivity, stop_detection, droidcam_ip
-    cap = cv2.VideoCapture(droidcam_ip)
-    if not cap.isOpened():
-        logging.error(f"Failed to open video capture with IP: {droidcam_ip}")
-        Clock.schedule_once(lambda dt: App.get_running_app().show_error("Camera Error", 
-            f"Unable to access video stream at {droidcam_ip}"), 0)
-        return
-    ret, frame1 = cap.read()
-    if not ret:
-        logging.error("Failed to read initial frame from video stream.")
-        cap.release()
-        return
-    ret, frame2 = cap.read()
-    if not ret:
-        logging.error("Failed to read second frame from video stream.")
-        cap.release()
-        return
-
-    fourcc = cv2.VideoWriter_fourcc(*'MJPG')
-    out = None
-    video_path = None
-    image_path = None
-
-    while cap.isOpened():
-        if stop_detection:
-            Clock.schedule_once(lambda dt: App.get_running_app().update_status_label("[b][color=757575]Detection Stopped[/color][/b]"), 0)
-            break
-
-        diff = cv2.absdiff(frame1, frame2)
-        gray = cv2.cvtColor(diff, cv2.COLOR_BGR2GRAY)
-        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-        _, thresh = cv2.threshold(blurred, 25, 255, cv2.THRESH_BINARY)
-        dilated = cv2.dilate(thresh, None, iterations=2)
-        contours, _ = cv2.findContours(dilated, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-
-        motion_in_zone = False
-        for contour in contours:
-            if cv2.contourArea(contour) < sensitivity:
-                continue
-            motion_in_zone = True
-            (x, y, w, h) = cv2.boundingRect(contour)
-            cv2.rectangle(frame1, (x, y), (x+w, y+h), (0, 255, 0), 2)
-
-        if motion_in_zone:
-            if not motion_detected:
-                threading.Thread(target=play_alert_sound).start()
-                Clock.schedule_once(lambda dt: App.get_running_app().update_status_label("[b][color=E53935]Motion Detected[/color][/b]"), 0)
-                motion_detected = True
-                recording = True
-                timestamp = time.strftime("%Y%m%d-%H%M%S")
-                target_folder = get_user_target_folder()
-                video_path = os.path.join(target_folder, f'motion_{timestamp}.avi')
-                out = cv2.VideoWriter(video_path, fourcc, 20.0, (frame1.shape[1], frame1.shape[0]))
-                if not out.isOpened():
-                    logging.error(f"Failed to initialize VideoWriter for {video_path}")
-                image_path = os.path.join(target_folder, f'image_{timestamp}.jpg')
-                cv2.imwrite(image_path, frame1)
-                print(f"Started recording to {video_path}")
-                logging.info(f"Started recording to {video_path}")
-            if recording and out and out.isOpened():
-                out.write(frame1)
+            smtp_session.send(sender_email, to, msg)
+        finally:
+            msg.close()
+        print("Email sent successfully!")
+        logging.info("Email with %d events (%.1f MB) sent successfully to %s, %.1f MB saved",
+                     len(batch), msg.size / 1e6, to, sum(msg.bytes_saved.values()) / 1e6)
+        for alert in batch:
+            log_sent_email(alert, msg.subject, msg.bytes_saved.get(alert['id'], 0))
+
+smtp_session = SMTPSession(config.get('smtp_host', "smtp.gmail.com"), config.get('smtp_port', 465),
+                           sender_email, password if config.get('smtp_auth', True) else None,
+                           use_ssl=config.get('smtp_ssl', True))
+# alert_digest_seconds > 0 merges the events within that window into one mail.
+alert_dispatcher = AlertDispatcher(deliver_email_alerts, ALERT_QUEUE_FILE, rate_limit=20.0,
+                                   digest_window=config.get('alert_digest_seconds', 0), permanent=permanent_failure)
+
+# -----------------------------------------------------------------------------
+# Motion Detector Hooks (called from the detector thread)
+# -----------------------------------------------------------------------------
+# How long stopping detection waits for the recording to be finalised.
+DETECTOR_STOP_TIMEOUT = 15.0
+# A camera that keeps failing and restarting shows its error at most this often.
+CAMERA_ERROR_INTERVAL = 60.0
+
+STATUS_LABELS = {
+    'no_motion': "[b][color=43A047]No Motion[/color][/b]",
+    'motion': "[b][color=E53935]Motion Detected[/color][/b]",
+    'stopped': "[b][color=757575]Detection Stopped[/color][/b]"
+}
+
+def join_motion_detector(detector):
+    detector.join(DETECTOR_STOP_TIMEOUT)
+    if detector.is_running():
+        logging.warning("Motion detector still closing after %.0fs", DETECTOR_STOP_TIMEOUT)
+
+def on_detector_status(detector, state):
+    Clock.schedule_once(lambda dt: App.get_running_app().update_status_label(STATUS_LABELS[state]), 0)
+
+def on_detector_motion_start(detector, video_path, image_path):
+    threading.Thread(target=play_alert_sound).start()
+
+def on_detector_motion_end(detector, video_path, image_path):
+    Clock.schedule_once(lambda dt: App.get_running_app().on_recorded_clip(video_path, image_path))
+    send_email_alert(video_path=video_path, image_path=image_path)
+
+def on_detector_frame(detector, frame):
+    preview = getattr(App.get_running_app(), 'preview', None)
+    if preview is not None:
+        preview.submit(frame)
+
+def on_detector_error(detector, title, message):
+    App.get_running_app().show_error(title, message)
+
+def get_camera_definitions():
+    # Cameras come from the optional 'cameras' list in config.json, e.g.
+    # [{"name": "porch", "source": "http://...:4747/video", "cpu_affinity": [1]}].
+    cameras = []
+    for index, camera in enumerate(config.get('cameras') or []):
+        camera = dict(camera)
+        camera.setdefault('name', f"camera{index + 1}")
+        # Top-level detector settings apply to every camera that doesn't override them.
+        for key in DETECTOR_CONFIG_KEYS:
+            if key in config:
+                camera.setdefault(key, config[key])
+        camera['target_folder'] = get_user_target_folder()
+        cameras.append(camera)
+    return cameras
+
+def create_motion_detector(source):
+    return MotionDetector(source, get_user_target_folder(),
+                          **detector_options(config),
+                          on_status=on_detector_status,
+                          on_motion_start=on_detector_motion_start,
+                          on_motion_end=on_detector_motion_end,
+                          on_frame=on_detector_frame,
+                          on_error=on_detector_error)
+
+# -----------------------------------------------------------------------------
+# Live Preview Widget (annotated detector frames inside the main screen)
+# -----------------------------------------------------------------------------
+# The detector only hands over a frame reference; the texture is refreshed from
+# the Kivy clock once per rendered frame, so the preview runs at the display
+# rate and never holds up analysis. Frames come either from an in-process
+# detector via submit() or from camera workers' shared-memory slots.
+class LivePreview(Image):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.allow_stretch = True
+        self.keep_ratio = True
+        self._lock = threading.Lock()
+        self._frame = None
+        self._seq = 0
+        self._shown_seq = 0
+        self._slots = []
+        self._slot_index = 0
+        self._event = None
+
+    def submit(self, frame):
+        with self._lock:
+            self._frame = frame
+            self._seq += 1
+
+    def attach_slots(self, slots):
+        self._slots = list(slots)
+        self._slot_index = 0
+        self._shown_seq = 0
+
+    def start(self):
+        if self._event is None:
+            self._event = Clock.schedule_interval(self._refresh, 0)
+
+    def stop(self):
+        if self._event is not None:
+            self._event.cancel()
+            self._event = None
+        with self._lock:
+            self._frame = None
+            self._seq = 0
+        self._slots = []
+        self._shown_seq = 0
+
+    def on_touch_down(self, touch):
+        # Tapping the preview cycles through the cameras being supervised.
+        if len(self._slots) > 1 and self.collide_point(*touch.pos):
+            self._slot_index = (self._slot_index + 1) % len(self._slots)
+            self._shown_seq = 0
+            return True
+        return super().on_touch_down(touch)
+
+    def _refresh(self, dt):
+        if self._slots:
+            slot = self._slots[self._slot_index]
+            seq, frame = slot.latest()
         else:
-            if motion_detected:
-                motion_detected = False
-                recording = False
-                if out and out.isOpened():
-                    out.release()
-                    out = None
-                    if os.path.exists(video_path) and os.path.getsize(video_path) > 0:
-                        send_email_alert(video_path=video_path, image_path=image_path)
-                    else:
-                        logging.error(f"Video file {video_path} is empty or not created.")
-                    video_path = None
-                    image_path = None
-                Clock.schedule_once(lambda dt: App.get_running_app().update_status_label("[b][color=43A047]No Motion[/color][/b]"), 0)
-                print("Stopped recording...")
-                logging.info("Stopped recording")
-        cv2.imshow("Motion Detector", frame1)
-        frame1 = frame2
-        ret, frame2 = cap.read()
-        if not ret:
-            logging.error("Failed to read frame during motion detection.")
-            break
-
-        key = cv2.waitKey(10) & 0xFF
-        if key == ord('q'):
-            break
-
-    cap.release()
-    if out and out.isOpened():
-        out.release()
-    cv2.destroyAllWindows()
+            slot = None
+            with self._lock:
+                seq, frame = self._seq, self._frame
+        if frame is None or seq == self._shown_seq:
+            return
+        self._blit(frame)
+        # If the worker lapped us mid-blit, draw it again on the next tick.
+        if slot is None or slot.is_current(seq):
+            self._shown_seq = seq
+
+    def _blit(self, frame):
+        height, width = frame.shape[:2]
+        colorfmt = 'bgr' if frame.ndim == 3 else 'luminance'
+        if self.texture is None or self.texture.size != (width, height) or self.texture.colorfmt != colorfmt:
+            texture = Texture.create(size=(width, height), colorfmt=colorfmt)
+            texture.flip_vertical()
+            self.texture = texture
+        self.texture.blit_buffer(frame.reshape(-1), colorfmt=colorfmt, bufferfmt='ubyte')
+        self.canvas.ask_update()
 
 # -----------------------------------------------------------------------------
 # Custom OpenCV-based Video Player Class (CVVideoPlayer)
 # -----------------------------------------------------------------------------
+# A decoder thread reads frames ahead into a small prefetch queue; the Kivy
+# clock only uploads the frame that is due into one persistent texture. Frames
+# are due by their timestamps (the clip's .timestamps sidecar, else index / fps)
+# measured from when playback started, so a slow UI skips frames instead of
+# playing in slow motion. A seek bumps `generation`, which makes frames decoded
+# before it stale. Frames come from a ClipFrameReader, which decodes MJPG clips
+# straight from their frame index and caches recent frames, so seeks and steps
+# (shown at once while paused) rarely touch VideoCapture.
 class CVVideoPlayer(BoxLayout):
+    PREFETCH_FRAMES = 8
+
     def __init__(self, video_path, **kwargs):
         super().__init__(**kwargs)
         self.orientation = 'vertical'
         self.video_path = video_path
         self.playing = False
-        self.capture = cv2.VideoCapture(video_path)
-        if not self.capture.isOpened():
+        self.reader = ClipFrameReader(video_path)
+        if not self.reader.is_opened():
             self.add_widget(Label(text="Error: Unable to open video file", color=(1,0,0,1)))
             return
-        self.total_frames = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT))
-        self.fps = self.capture.get(cv2.CAP_PROP_FPS)
+        self.total_frames = self.reader.frame_count
+        self.fps = self.reader.fps
+        # Recorded clips carry their real capture times; MP4 headers in
+        # particular may report no frame count at all.
+        self.timestamps = read_clip_timestamps(video_path)
+        if self.timestamps:
+            if self.total_frames <= 0:
+                self.total_frames = len(self.timestamps)
+            if len(self.timestamps) > 1 and self.timestamps[-1] > self.timestamps[0]:
+                self.fps = (len(self.timestamps) - 1) / (self.timestamps[-1] - self.timestamps[0])
         if self.fps <= 0:
             self.fps = 30
         self.current_frame = 0
-        self.image_widget = Image()
+        self.dropped_frames = 0
+        self.image_widget = Image(allow_stretch=True, keep_ratio=True)
         self.add_widget(self.image_widget)
+        self.frames = queue.Queue(maxsize=self.PREFETCH_FRAMES)
+        self.position_lock = threading.Lock()
+        self.generation = 0
+        self.decode_position = 0
+        self._pending = None
+        self._play_origin = 0.0
+        self._decoding = False
+        self._decoder = None
         self._update_event = None
 
+    def frame_time(self, index):
+        if self.timestamps and index < len(self.timestamps):
+            return self.timestamps[index] - self.timestamps[0]
+        return index / self.fps
+
+    def _decode(self):
+        while self._decoding:
+            with self.position_lock:
+                generation = self.generation
+                index = self.decode_position
+                self.decode_position += 1
+            frame = self.reader.read(index)
+            item = (generation, index, frame)
+            while self._decoding and generation == self.generation:
+                try:
+                    self.frames.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if frame is None and generation == self.generation:
+                # End of clip: wait here until a seek or stop.
+                while self._decoding and generation == self.generation:
+                    time.sleep(0.05)
+
+    def _start_decoder(self):
+        if self._decoder is None or not self._decoder.is_alive():
+            self._decoding = True
+            self._decoder = threading.Thread(target=self._decode, daemon=True)
+            self._decoder.start()
+
+    def _stop_decoder(self):
+        self._decoding = False
+        if self._decoder is not None:
+            self._decoder.join(timeout=1.0)
+            self._decoder = None
+
     def start(self):
-        if not self.playing:
+        if not self.playing and self.reader.is_opened():
             self.playing = True
-            self._update_event = Clock.schedule_interval(self.update, 1.0 / self.fps)
+            self._play_origin = time.perf_counter() - self.frame_time(self.current_frame)
+            self._start_decoder()
+            self._update_event = Clock.schedule_interval(self.update, 0)
 
     def pause(self):
         if self.playing:
@@ -650,25 +716,69 @@ class CVVideoPlayer(BoxLayout):
 
     def stop(self):
         self.pause()
-        if self.capture and self.capture.isOpened():
-            self.capture.release()
+        self._stop_decoder()
+        self.reader.release()
+
+    def _next_frame(self):
+        if self._pending is None:
+            try:
+                self._pending = self.frames.get_nowait()
+            except queue.Empty:
+                return None
+        if self._pending[0] != self.generation:
+            self._pending = None
+            return self._next_frame()
+        return self._pending
 
     def update(self, dt):
-        ret, frame = self.capture.read()
-        if ret:
-            self.current_frame = int(self.capture.get(cv2.CAP_PROP_POS_FRAMES))
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            texture = Texture.create(size=(frame.shape[1], frame.shape[0]), colorfmt='rgb')
-            texture.blit_buffer(frame.tobytes(), colorfmt='rgb', bufferfmt='ubyte')
+        elapsed = time.perf_counter() - self._play_origin
+        due = None
+        while True:
+            item = self._next_frame()
+            if item is None:
+                break
+            generation, index, frame = item
+            if frame is None:
+                if due is None:
+                    self.stop()
+                    return
+                break
+            if self.frame_time(index) > elapsed:
+                break
+            if due is not None:
+                self.dropped_frames += 1
+            due = item
+            self._pending = None
+        if due is not None:
+            self.current_frame = due[1]
+            self._blit(due[2])
+
+    def _blit(self, frame):
+        height, width = frame.shape[:2]
+        texture = self.image_widget.texture
+        if texture is None or texture.size != (width, height) or texture.colorfmt != 'bgr':
+            texture = Texture.create(size=(width, height), colorfmt='bgr')
             texture.flip_vertical()
             self.image_widget.texture = texture
-        else:
-            self.stop()
+        texture.blit_buffer(frame.reshape(-1), colorfmt='bgr', bufferfmt='ubyte')
+        self.image_widget.canvas.ask_update()
 
     def seek(self, frame_index):
-        if self.capture and self.capture.isOpened():
-            self.capture.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+        # The popup's slider follows playback; echoing its position back here
+        # must not throw away the prefetched frames.
+        if frame_index == self.current_frame:
+            return
+        if self.reader.is_opened():
+            with self.position_lock:
+                self.decode_position = frame_index
+                self.generation += 1
+            self._pending = None
             self.current_frame = frame_index
+            self._play_origin = time.perf_counter() - self.frame_time(frame_index)
+            if not self.playing:
+                frame = self.reader.read(frame_index)
+                if frame is not None:
+                    self._blit(frame)
 
 # -----------------------------------------------------------------------------
 # Popup Classes with modern styling
@@ -713,12 +823,19 @@ class SettingsPopup(BasePopup):
         self.content.add_widget(self.body_input)
         self.content.add_widget(Label(text="DroidCam IP:", font_size=dp(18), color=theme['text_color']))
         self.content.add_widget(self.ip_input)
+        self.codec_spinner = Spinner(text=config.get('record_codec', 'MJPG'), values=sorted(RECORD_CODECS),
+                                     size_hint=(1, None), height=dp(45))
+        self.content.add_widget(Label(text="Recording Codec:", font_size=dp(18), color=theme['text_color']))
+        self.content.add_widget(self.codec_spinner)
         btn_layout = BoxLayout(size_hint=(1, None), height=dp(50), spacing=dp(12))
         self.save_button = HoverButton(text="[b]Save[/b]", font_size=dp(20))
         self.save_button.bind(on_release=self.save_settings)
         self.cancel_button = HoverButton(text="[b]Cancel[/b]", font_size=dp(20))
         self.cancel_button.bind(on_release=self.dismiss)
+        self.zones_button = HoverButton(text="[b]Edit Zones[/b]", font_size=dp(20))
+        self.zones_button.bind(on_release=lambda inst: ZoneEditorPopup().open())
         btn_layout.add_widget(self.save_button)
+        btn_layout.add_widget(self.zones_button)
         btn_layout.add_widget(self.cancel_button)
         self.content.add_widget(btn_layout)
     def save_settings(self, instance):
@@ -731,28 +848,168 @@ class SettingsPopup(BasePopup):
         config['email_subject'] = default_subject
         config['email_body'] = default_body
         config['droidcam_ip'] = droidcam_ip
+        config['record_codec'] = self.codec_spinner.text
         with open(CONFIG_FILE, "w") as file:
             json.dump(config, file)
         logging.info(f"DroidCam IP updated to: {droidcam_ip}")
         self.dismiss()
 
+# -----------------------------------------------------------------------------
+# Zone Editor: draw include/exclude polygons over the live preview
+# -----------------------------------------------------------------------------
+class ZoneEditorPopup(BasePopup):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.title = "Motion Zones"
+        self.size_hint = (0.9, 0.9)
+        self.auto_dismiss = False
+        # Zones are stored on config itself (all cameras) or on a camera entry.
+        self.targets = {'All Cameras': config}
+        for index, camera in enumerate(config.get('cameras') or []):
+            self.targets[camera.get('name', f"camera{index + 1}")] = camera
+        self.target = config
+        self.zones = [dict(zone) for zone in config.get('zones', [])]
+        self.points = []
+        layout = BoxLayout(orientation='vertical', spacing=dp(10), padding=dp(10))
+        with layout.canvas.before:
+            Color(1, 1, 1, 1)
+            layout.bg_rect = RoundedRectangle(size=layout.size, pos=layout.pos, radius=[theme['card_radius']])
+        layout.bind(size=lambda inst, val: setattr(layout.bg_rect, 'size', val))
+        layout.bind(pos=lambda inst, val: setattr(layout.bg_rect, 'pos', val))
+        self.target_spinner = Spinner(text='All Cameras', values=tuple(self.targets), size_hint=(1, None), height=dp(45))
+        self.target_spinner.bind(text=self.on_target_selected)
+        layout.add_widget(self.target_spinner)
+        self.image = Image(allow_stretch=True, keep_ratio=True)
+        preview = getattr(App.get_running_app(), 'preview', None)
+        if preview is not None and preview.texture is not None:
+            self.image.texture = preview.texture
+        self.image.bind(pos=self.redraw, size=self.redraw, texture=self.redraw, on_touch_down=self.on_image_touch)
+        layout.add_widget(self.image)
+        self.hint_label = Label(text="Tap the picture to add points, then press Finish Zone.",
+                                font_size=dp(16), color=theme['text_color'], size_hint=(1, None), height=dp(30))
+        layout.add_widget(self.hint_label)
+        form = BoxLayout(size_hint=(1, None), height=dp(45), spacing=dp(10))
+        self.name_input = TextInput(hint_text="Zone name", multiline=False, font_size=dp(18),
+                                    foreground_color=theme['text_color'])
+        self.type_spinner = Spinner(text='include', values=('include', 'exclude'), size_hint=(0.3, 1))
+        form.add_widget(self.name_input)
+        form.add_widget(self.type_spinner)
+        layout.add_widget(form)
+        btn_layout = BoxLayout(size_hint=(1, None), height=dp(50), spacing=dp(12))
+        for text, callback in (("Finish Zone", self.finish_zone), ("Undo Point", self.undo_point),
+                               ("Clear All", self.clear_zones), ("Save", self.save_zones), ("Cancel", self.dismiss)):
+            button = HoverButton(text=f"[b]{text}[/b]", font_size=dp(18))
+            button.bind(on_release=callback)
+            btn_layout.add_widget(button)
+        layout.add_widget(btn_layout)
+        self.content = layout
+
+    def on_target_selected(self, spinner, text):
+        self.target = self.targets[text]
+        self.zones = [dict(zone) for zone in self.target.get('zones', [])]
+        self.points = []
+        self.redraw()
+
+    def _image_rect(self):
+        width, height = self.image.norm_image_size
+        return self.image.center_x - width / 2, self.image.center_y - height / 2, width, height
+
+    def on_image_touch(self, widget, touch):
+        if not widget.collide_point(*touch.pos):
+            return False
+        x, y, width, height = self._image_rect()
+        if width <= 0 or height <= 0 or not (x <= touch.x <= x + width and y <= touch.y <= y + height):
+            return False
+        # Stored as fractions of the frame, with the origin at the top left like OpenCV.
+        self.points.append([round((touch.x - x) / width, 4), round(1 - (touch.y - y) / height, 4)])
+        self.redraw()
+        return True
+
+    def _screen_points(self, points):
+        x, y, width, height = self._image_rect()
+        flat = []
+        for u, v in points:
+            flat.extend([x + u * width, y + (1 - v) * height])
+        return flat
+
+    def redraw(self, *args):
+        self.image.canvas.after.clear()
+        with self.image.canvas.after:
+            for zone in self.zones:
+                if zone.get('type', 'include') == 'include':
+                    Color(0.26, 0.63, 0.28, 1)
+                else:
+                    Color(0.9, 0.22, 0.21, 1)
+                Line(points=self._screen_points(zone['points']), close=True, width=dp(1.5))
+            if self.points:
+                Color(1, 0.76, 0.03, 1)
+                Line(points=self._screen_points(self.points), width=dp(1.5))
+
+    def finish_zone(self, instance):
+        if len(self.points) < 3:
+            App.get_running_app().show_error("Invalid Zone", "A zone needs at least three points.")
+            return
+        name = self.name_input.text.strip() or f"zone{len(self.zones) + 1}"
+        self.zones.append({'name': name, 'type': self.type_spinner.text, 'points': self.points})
+        self.points = []
+        self.name_input.text = ""
+        self.redraw()
+
+    def undo_point(self, instance):
+        if self.points:
+            self.points.pop()
+        elif self.zones:
+            self.zones.pop()
+        self.redraw()
+
+    def clear_zones(self, instance):
+        self.zones = []
+        self.points = []
+        self.redraw()
+
+    def save_zones(self, instance):
+        self.target['zones'] = self.zones
+        with open(CONFIG_FILE, "w") as file:
+            json.dump(config, file)
+        logging.info("Saved %d motion zones for %s", len(self.zones), self.target_spinner.text)
+        app = App.get_running_app()
+        if self.target is config and app.detector is not None and app.detector.is_running():
+            app.detector.set_zones(self.zones)
+        app.show_popup("Zones Saved", "Motion zones updated.")
+        self.dismiss()
+
 class EmailLogItem(BoxLayout):
     text = StringProperty('')
 
 class EmailLogRecycleView(RecycleView):
+    # Entries are read a page at a time, newest first; scrolling to the end
+    # of the list loads the next page.
+    PAGE_SIZE = 50
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.data = []
+        self.page = 0
+        self.exhausted = False
+        self.bind(scroll_y=self.on_scroll)
         self.load_emails()
     def load_emails(self):
         self.data = []
-        email_log_file = get_user_email_log_file()
-        if os.path.exists(email_log_file):
-            with open(email_log_file, "r") as file:
-                email_log = json.load(file)
-            for email_entry in reversed(email_log):
-                email_info = f"[b]To:[/b] {email_entry['to']}\n[b]Subject:[/b] {email_entry['subject']}\n[b]Time:[/b] {email_entry['time']}"
-                self.data.append({'text': email_info})
+        self.page = 0
+        self.exhausted = False
+        self.load_next_page()
+    def load_next_page(self):
+        if self.exhausted:
+            return
+        entries = open_email_log(get_user_email_log_file()).read_page(self.page, self.PAGE_SIZE)
+        self.exhausted = len(entries) < self.PAGE_SIZE
+        self.page += 1
+        self.data.extend(
+            {'text': f"[b]To:[/b] {email_entry['to']}\n[b]Subject:[/b] {email_entry['subject']}\n[b]Time:[/b] {email_entry['time']}"}
+            for email_entry in entries)
+    def on_scroll(self, instance, scroll_y):
+        if scroll_y <= 0.02 and self.data:
+            self.load_next_page()
 
 class EmailLogPopup(BasePopup):
     def __init__(self, **kwargs):
@@ -864,22 +1121,39 @@ class ImageViewerPopup(BasePopup):
         self.title = "Image Viewer"
         self.size_hint = (0.9, 0.9)
         layout = BoxLayout(orientation='vertical', spacing=dp(12))
-        self.image = Image(source=image_path, allow_stretch=True, keep_ratio=True)
+        self.image_path = image_path
+        self.image = Image(allow_stretch=True, keep_ratio=True)
         layout.add_widget(self.image)
         close_btn = HoverButton(text="[b]Close[/b]", font_size=dp(20), size_hint=(1, 0.15))
         close_btn.bind(on_release=lambda inst: self.dismiss())
         layout.add_widget(close_btn)
         self.content = layout
 
+    def on_open(self):
+        # Decode no more of the snapshot than the popup can show.
+        frame = read_reduced(self.image_path, Window.width * self.size_hint[0], Window.height * self.size_hint[1])
+        if frame is None:
+            App.get_running_app().show_error("Image Error", f"Could not open {os.path.basename(self.image_path)}.")
+            return
+        height, width = frame.shape[:2]
+        texture = Texture.create(size=(width, height), colorfmt='bgr')
+        texture.flip_vertical()
+        texture.blit_buffer(frame.reshape(-1), colorfmt='bgr', bufferfmt='ubyte')
+        self.image.texture = texture
+
 # -----------------------------------------------------------------------------
 # Media List and Sorting Features (unchanged)
 # -----------------------------------------------------------------------------
 class MediaListItem(BoxLayout):
     text = StringProperty('')
     media_path = StringProperty('')
+    start = NumericProperty(0)
+    event_name = StringProperty('')
+    event_id = NumericProperty(0)
+    thumbnail = StringProperty('')
 
     def view_media(self):
-        if self.media_path.endswith('.avi'):
+        if self.media_path.endswith(VIDEO_EXTENSIONS):
             player = VideoPlayerPopup(video_path=self.media_path)
             player.open()
         else:
@@ -889,32 +1163,131 @@ class MediaListItem(BoxLayout):
     def delete_media(self):
         if os.path.exists(self.media_path):
             os.remove(self.media_path)
+            if self.media_path.endswith(VIDEO_EXTENSIONS):
+                for sidecar in (clip_timestamps_path(self.media_path), clip_frame_index_path(self.media_path)):
+                    if os.path.exists(sidecar):
+                        os.remove(sidecar)
+            open_event_index(get_user_target_folder()).remove_media(self.media_path)
+            open_thumbnail_cache(get_user_target_folder()).discard(self.media_path)
             App.get_running_app().show_popup("Deleted", f"{os.path.basename(self.media_path)} deleted.")
-            App.get_running_app().media_list_popup.media_view.load_media()
+            App.get_running_app().media_list_popup.media_view.remove_path(self.media_path)
+
+def media_rows(event):
+    # A recorded event shows up as its clip and its snapshot.
+    started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(event['start']))
+    keys = {'start': event['start'], 'event_name': event['name'], 'event_id': event['id']}
+    rows = []
+    if event['video_path']:
+        details = f"{started}, {event['duration'] or 0:.0f}s, {(event['size'] or 0) / 1e6:.1f} MB"
+        rows.append(dict(keys, text=f"{os.path.basename(event['video_path'])}\n[size=13sp]{details}[/size]",
+                         media_path=event['video_path']))
+    if event['image_path']:
+        rows.append(dict(keys, text=os.path.basename(event['image_path']), media_path=event['image_path']))
+    return rows
+
+def provisional_row(path):
+    # A file the index has no event for yet (a clip still being written).
+    name = os.path.splitext(os.path.basename(path))[0]
+    if name.startswith('image_'):
+        name = 'motion_' + name[len('image_'):]
+    text = os.path.basename(path)
+    if path.endswith(VIDEO_EXTENSIONS):
+        text += "\n[size=13sp]recording\u2026[/size]"
+    return {'text': text, 'media_path': path, 'start': time.time(), 'event_name': name, 'event_id': 0}
 
 class MediaRecycleView(RecycleView):
+    # Rows come from the Target folder's event index a page of events at a
+    # time; scrolling to the end of the list loads the next page. New, changed
+    # and deleted media are patched into the loaded rows in place.
+    PAGE_SIZE = 50
+
     def __init__(self, sort_order="newest", **kwargs):
         super().__init__(**kwargs)
         self.sort_order = sort_order
         self.data = []
+        self.cursor = None
+        self.exhausted = False
+        self.bind(scroll_y=self.on_scroll)
         self.load_media()
 
     def load_media(self):
         self.data = []
+        self.cursor = None
+        self.exhausted = False
         target_folder = get_user_target_folder()
-        if os.path.exists(target_folder):
-            media_files = [f for f in os.listdir(target_folder) if f.endswith('.avi') or f.endswith('.jpg')]
-            if self.sort_order == "newest":
-                media_files.sort(key=lambda f: os.path.getmtime(os.path.join(target_folder, f)), reverse=True)
-            elif self.sort_order == "oldest":
-                media_files.sort(key=lambda f: os.path.getmtime(os.path.join(target_folder, f)))
-            elif self.sort_order == "name_az":
-                media_files.sort()
-            elif self.sort_order == "name_za":
-                media_files.sort(reverse=True)
-            for media_file in media_files:
-                media_path = os.path.join(target_folder, media_file)
-                self.data.append({'text': media_file, 'media_path': media_path})
+        # Picks up files the recorders did not index (see import_folder).
+        open_event_index(target_folder).import_folder(target_folder, VIDEO_EXTENSIONS, read_clip_timestamps)
+        self.load_next_page()
+
+    def load_next_page(self):
+        if self.exhausted:
+            return
+        events = open_event_index(get_user_target_folder()).page(self.sort_order, self.cursor, self.PAGE_SIZE)
+        self.exhausted = len(events) < self.PAGE_SIZE
+        if events:
+            self.cursor = events[-1]
+        # Rows patched in since the last page may come round again.
+        loaded = {row['media_path'] for row in self.data}
+        self.data.extend(self.with_thumbnails(
+            [row for event in events for row in media_rows(event) if row['media_path'] not in loaded]))
+
+    def with_thumbnails(self, rows):
+        # Missing thumbnails are made in the background and patched in.
+        cache = open_thumbnail_cache(get_user_target_folder())
+        for row in rows:
+            row['thumbnail'] = cache.request(row['media_path'], self._thumbnail_ready) or ''
+        return rows
+
+    def _thumbnail_ready(self, media_path, thumbnail):
+        Clock.schedule_once(lambda dt: self.set_thumbnail(media_path, thumbnail))
+
+    def set_thumbnail(self, media_path, thumbnail):
+        for position, row in enumerate(self.data):
+            if row['media_path'] == media_path:
+                self.data[position] = dict(row, thumbnail=thumbnail)
+                return
+
+    def _sort_key(self, row):
+        if self.sort_order in ('newest', 'oldest'):
+            return row['start']
+        return row['event_name']
+
+    def _insert_position(self, row):
+        key = self._sort_key(row)
+        descending = self.sort_order in ('newest', 'name_za')
+        for position, existing in enumerate(self.data):
+            other = self._sort_key(existing)
+            if (key > other) if descending else (key < other):
+                return position
+        # Past the loaded rows: it arrives with a later page instead.
+        return len(self.data) if self.exhausted else None
+
+    def add_rows(self, rows):
+        for row in rows:
+            for position, existing in enumerate(self.data):
+                if existing['media_path'] == row['media_path']:
+                    self.with_thumbnails([row])
+                    if existing != row:
+                        self.data[position] = row
+                    break
+            else:
+                position = self._insert_position(row)
+                if position is not None:
+                    self.data.insert(position, self.with_thumbnails([row])[0])
+
+    def refresh_path(self, path):
+        event = open_event_index(get_user_target_folder()).find(path)
+        self.add_rows(media_rows(event) if event else [provisional_row(path)])
+
+    def remove_path(self, path):
+        for position, row in enumerate(self.data):
+            if row['media_path'] == path:
+                self.data.pop(position)
+                return
+
+    def on_scroll(self, instance, scroll_y):
+        if scroll_y <= 0.02 and self.data:
+            self.load_next_page()
 
 class MediaListPopup(BasePopup):
     def __init__(self, **kwargs):
@@ -936,8 +1309,26 @@ class MediaListPopup(BasePopup):
         close_btn.bind(on_release=self.dismiss)
         layout.add_widget(close_btn)
         self.content = layout
+        self.watcher = None
     def on_open(self):
         self.media_view.load_media()
+        target_folder = get_user_target_folder()
+        self.watcher = MediaFolderWatcher(target_folder, VIDEO_EXTENSIONS + ('.jpg',),
+                                          lambda path: self.on_media_created(target_folder, path),
+                                          lambda path: self.on_media_deleted(target_folder, path)).start()
+    def on_dismiss(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+    # Watcher callbacks run on its thread; the rows are updated on the UI thread.
+    def on_media_created(self, folder, path):
+        path = os.path.join(folder, os.path.basename(path))
+        Clock.schedule_once(lambda dt: self.media_view.refresh_path(path))
+    def on_media_deleted(self, folder, path):
+        path = os.path.join(folder, os.path.basename(path))
+        open_event_index(folder).remove_media(path)
+        open_thumbnail_cache(folder).discard(path)
+        Clock.schedule_once(lambda dt: self.media_view.remove_path(path))
     def on_sort_selected(self, spinner, text):
         order_map = {
             "Newest First": "newest",
@@ -1052,6 +1443,10 @@ class UserRecycleView(RecycleView):
 # Main Application Class
 # -----------------------------------------------------------------------------
 class MotionDetectionApp(App):
+    detector = None
+    supervisor = None
+    _detector_stats_event = None
+
     def build(self):
         self.title = "Motion Detector Security System"
         self.root = FloatLayout()
@@ -1061,6 +1456,8 @@ class MotionDetectionApp(App):
         self.login_layout = self.create_login_layout()
         self.root.add_widget(self.login_layout)
         Window.bind(on_resize=self.on_window_resize)
+        # Sends anything left queued from the last session straight away.
+        alert_dispatcher.start()
         return self.root
 
     def create_login_layout(self):
@@ -1134,8 +1531,16 @@ class MotionDetectionApp(App):
             self.center_rect = Rectangle(size=center_box.size, pos=center_box.pos)
         center_box.bind(size=lambda inst, val: setattr(self.center_rect, 'size', val))
         center_box.bind(pos=lambda inst, val: setattr(self.center_rect, 'pos', val))
-        center_box.add_widget(self.status_label)
+        center_content = BoxLayout(orientation='vertical', spacing=dp(8), padding=dp(8))
+        self.preview = LivePreview(size_hint=(1, 0.8))
+        self.status_label.size_hint = (1, 0.2)
+        center_content.add_widget(self.preview)
+        center_content.add_widget(self.status_label)
+        center_box.add_widget(center_content)
         layout.add_widget(center_box)
+        self.camera_stats_label = Label(text="", markup=True, font_size=dp(16), size_hint=(1, 0.06),
+                                        halign='center', valign='middle', color=theme['text_color'])
+        layout.add_widget(self.camera_stats_label)
         bottom_bar = BoxLayout(orientation='horizontal', size_hint=(1, 0.15), padding=dp(12), spacing=dp(12))
         with bottom_bar.canvas.before:
             Color(1, 1, 1, 1)
@@ -1197,16 +1602,49 @@ class MotionDetectionApp(App):
         AddUserPopup().open()
 
     def start_motion_detection(self, instance):
-        global stop_detection, recording
-        stop_detection = False
-        recording = False
-        Clock.schedule_once(lambda dt: self.update_status_label("[b][color=43A047]No Motion[/color][/b]"), 0)
-        threading.Thread(target=motion_detection).start()
-
-    def stop_motion_detection(self, instance):
-        global stop_detection
-        stop_detection = True
-        Clock.schedule_once(lambda dt: self.update_status_label("[b][color=757575]Detection Stopped[/color][/b]"), 0)
+        if self.supervisor is not None or (self.detector is not None and self.detector.is_running()):
+            return
+        Clock.schedule_once(lambda dt: self.update_status_label(STATUS_LABELS['no_motion']), 0)
+        cameras = get_camera_definitions()
+        if cameras:
+            self.camera_states = {}
+            self.camera_errors = {}
+            self.supervisor = CameraSupervisor(cameras).start()
+            self._supervisor_event = Clock.schedule_interval(self.poll_supervisor, 0.5)
+            if hasattr(self, 'preview'):
+                self.preview.attach_slots(self.supervisor.slots.values())
+        else:
+            self.detector = create_motion_detector(droidcam_ip)
+            self.detector.start()
+            # A detector whose stream ended leaves its stats poll behind.
+            if self._detector_stats_event is not None:
+                self._detector_stats_event.cancel()
+            self._detector_stats_event = Clock.schedule_interval(self.poll_detector_stats, 1.0)
+        if hasattr(self, 'preview'):
+            self.preview.start()
+
+    def stop_motion_detection(self, instance, wait=False):
+        if hasattr(self, 'preview'):
+            self.preview.stop()
+        if self.detector is not None:
+            self.detector.stop()
+            # close() finalises the open clip and drains the writer's queue,
+            # which the daemon threads would not survive at exit. Only on_stop
+            # blocks for it; otherwise it finishes in the background.
+            if wait:
+                join_motion_detector(self.detector)
+            else:
+                threading.Thread(target=join_motion_detector, args=(self.detector,), daemon=True).start()
+            if self._detector_stats_event is not None:
+                self._detector_stats_event.cancel()
+                self._detector_stats_event = None
+            self.update_camera_stats_label({})
+        if self.supervisor is not None:
+            self._supervisor_event.cancel()
+            self.supervisor.stop()
+            self.supervisor = None
+            self.update_camera_stats_label({})
+        Clock.schedule_once(lambda dt: self.update_status_label(STATUS_LABELS['stopped']), 0)
 
     def create_menu_layout(self):
         self.menu_open = False
@@ -1284,6 +1722,49 @@ class MotionDetectionApp(App):
         self.root.add_widget(self.create_login_layout())
         current_user = None
 
+    def on_recorded_clip(self, video_path, image_path):
+        # The clip is indexed by now; swap its provisional rows for the real ones.
+        popup = getattr(self, 'media_list_popup', None)
+        if popup is not None and popup.watcher is not None:
+            for path in (video_path, image_path):
+                if path:
+                    popup.media_view.refresh_path(path)
+
+    def poll_supervisor(self, dt):
+        for event in self.supervisor.poll_events():
+            kind = event['event']
+            if kind == 'status':
+                self.camera_states[event['camera']] = event['state']
+                states = self.camera_states.values()
+                self.update_status_label(STATUS_LABELS['motion'] if 'motion' in states else STATUS_LABELS['no_motion'])
+            elif kind == 'motion_start':
+                threading.Thread(target=play_alert_sound).start()
+            elif kind == 'motion_end':
+                self.on_recorded_clip(event['video_path'], event['image_path'])
+                send_email_alert(video_path=event['video_path'], image_path=event['image_path'])
+            elif kind == 'error':
+                # Workers log their own errors; only the popup is rate-limited.
+                last_shown = self.camera_errors.get(event['camera'])
+                if last_shown is None or event['time'] - last_shown >= CAMERA_ERROR_INTERVAL:
+                    self.camera_errors[event['camera']] = event['time']
+                    self.show_error(f"{event['title']} ({event['camera']})", event['message'])
+        self.update_camera_stats_label(self.supervisor.stats)
+
+    def poll_detector_stats(self, dt):
+        if self.detector is not None and self.detector.is_running():
+            self.update_camera_stats_label({'Camera': self.detector.stats()})
+
+    def update_camera_stats_label(self, stats):
+        if hasattr(self, 'camera_stats_label'):
+            self.camera_stats_label.text = "   ".join(
+                f"[b]{name}:[/b] {stat['fps']:.1f} FPS, {stat['backend']} {stat['backend_ms']:.1f} ms"
+                + (f", quiet {stat['fast_path_ratio']:.0%}" if 'fast_path_ratio' in stat else "")
+                + (f", pre-roll {stat['pre_roll_bytes'] / 1e6:.1f} MB" if 'pre_roll_bytes' in stat else "")
+                + (f", rec queue {stat['record_queue_depth']} ({stat['record_latency_ms']:.0f} ms)"
+                   if stat.get('record_queue_depth') else "")
+                + "".join(f", {zone} {energy:.0%}" for zone, energy in stat.get('zones', {}).items())
+                for name, stat in sorted(stats.items()))
+
     def update_status_label(self, text):
         if hasattr(self, 'status_label'):
             self.status_label.text = text
@@ -1319,8 +1800,12 @@ class MotionDetectionApp(App):
             self.menu_layout.pos = (-width * 0.6, 0)
 
     def on_stop(self):
-        global stop_detection
-        stop_detection = True
+        self.stop_motion_detection(None, wait=True)
+        alert_dispatcher.stop()
+        smtp_session.close()
+        close_email_logs()
+        close_event_indexes()
+        close_thumbnail_caches()
 
     def create_admin_layout(self):
         layout = BoxLayout(orientation='vertical')
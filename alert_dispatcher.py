@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+
+# -----------------------------------------------------------------------------
+# Alert Dispatcher (delivers alerts from its own thread, survives restarts)
+# -----------------------------------------------------------------------------
+# Alerts are small dicts (everything needed to send them later, e.g. recipient,
+# subject and attachment paths). submit() only records the alert and returns, so
+# callers on detection or clip-writer threads never wait on the network. The
+# pending queue is mirrored to `queue_file` after every change, and anything
+# still pending when the app exits is sent on the next start.
+#
+# send(alerts) gets a list of alerts to deliver together and must raise on
+# failure; they are then retried after base_delay, 2 * base_delay, ... (capped
+# at max_delay) and dropped after max_attempts, or at once when
+# permanent(error) says retrying cannot help. Without a digest window every
+# alert goes out on its own, and alerts submitted within `rate_limit` seconds of
+# the previously accepted one are dropped, as the inline sender used to do.
+# With `digest_window` seconds set, nothing is dropped: an alert opens a window
+# and everything submitted before it closes is handed to send() as one batch.
+class AlertDispatcher:
+    def __init__(self, send, queue_file, rate_limit=20.0, max_attempts=8, base_delay=5.0, max_delay=600.0,
+                 digest_window=0, permanent=None):
+        self.send = send
+        self.permanent = permanent
+        self.queue_file = queue_file
+        self.rate_limit = rate_limit
+        self.digest_window = digest_window
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.condition = threading.Condition()
+        self.pending = self._load()
+        self.last_accepted = 0.0
+        self.sent = 0
+        self.failed = 0
+        self.running = False
+        self._thread = None
+
+    def _load(self):
+        if not os.path.exists(self.queue_file):
+            return []
+        try:
+            with open(self.queue_file, "r") as file:
+                pending = json.load(file)
+        except (OSError, ValueError) as e:
+            logging.error("Could not read alert queue %s: %s", self.queue_file, e)
+            return []
+        if pending:
+            logging.info("Loaded %d pending alerts from %s", len(pending), self.queue_file)
+        for alert in pending:
+            # Whatever was waiting before the restart is due now.
+            alert['next_try'] = 0.0
+        return pending
+
+    def _save(self):
+        # Called with the condition held. Write-then-rename, so a crash mid-write
+        # leaves the previous queue intact.
+        temp_file = self.queue_file + ".tmp"
+        try:
+            with open(temp_file, "w") as file:
+                json.dump(self.pending, file)
+            os.replace(temp_file, self.queue_file)
+        except OSError as e:
+            logging.error("Could not save alert queue %s: %s", self.queue_file, e)
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return self
+            self.running = True
+        self._thread = threading.Thread(target=self._run, name="alert-dispatcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def submit(self, **alert):
+        now = time.time()
+        with self.condition:
+            if self.digest_window:
+                # Join the digest that is still collecting, or open a new one.
+                open_batches = [a['next_try'] for a in self.pending if a['attempts'] == 0 and a['next_try'] > now]
+                due = min(open_batches) if open_batches else now + self.digest_window
+            elif now - self.last_accepted < self.rate_limit:
+                logging.info("Alert dropped: less than %.0fs since the previous one", self.rate_limit)
+                return False
+            else:
+                due = 0.0
+            self.last_accepted = now
+            alert.update(id=uuid.uuid4().hex, created=now, attempts=0, next_try=due)
+            self.pending.append(alert)
+            self._save()
+            self.condition.notify()
+        return True
+
+    def _next_due(self):
+        return min(self.pending, key=lambda alert: alert['next_try']) if self.pending else None
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running:
+                    alert = self._next_due()
+                    wait = alert['next_try'] - time.time() if alert else None
+                    if alert and wait <= 0:
+                        break
+                    self.condition.wait(wait)
+                if not self.running:
+                    return
+                if self.digest_window:
+                    now = time.time()
+                    batch = sorted((a for a in self.pending if a['next_try'] <= now), key=lambda a: a['created'])
+                else:
+                    batch = [alert]
+            try:
+                self.send(batch)
+            except Exception as e:
+                self._retry(batch, e)
+            else:
+                sent_ids = {a['id'] for a in batch}
+                with self.condition:
+                    self.pending = [a for a in self.pending if a['id'] not in sent_ids]
+                    self.sent += len(batch)
+                    self._save()
+
+    def _retry(self, batch, error):
+        with self.condition:
+            # A batch retries as a unit, so a digest stays one message.
+            given_up = set()
+            retry_at = None
+            permanent = self.permanent is not None and self.permanent(error)
+            for alert in batch:
+                alert['attempts'] += 1
+                if permanent or alert['attempts'] >= self.max_attempts:
+                    given_up.add(alert['id'])
+                    continue
+                delay = min(self.base_delay * 2 ** (alert['attempts'] - 1), self.max_delay)
+                retry_at = max(retry_at or 0.0, time.time() + delay)
+            for alert in batch:
+                if alert['id'] not in given_up:
+                    alert['next_try'] = retry_at
+            if given_up:
+                if permanent:
+                    logging.error("Giving up on %d alerts, refused permanently: %s", len(given_up), error)
+                else:
+                    logging.error("Giving up on %d alerts after %d attempts: %s", len(given_up), self.max_attempts, error)
+                self.pending = [a for a in self.pending if a['id'] not in given_up]
+                self.failed += len(given_up)
+            if retry_at is not None:
+                logging.warning("Sending %d alerts failed, retrying in %.0fs: %s",
+                                len(batch) - len(given_up), retry_at - time.time(), error)
+            self._save()
+
+    def stats(self):
+        with self.condition:
+            return {'alerts_pending': len(self.pending), 'alerts_sent': self.sent, 'alerts_failed': self.failed}
+
+    def stop(self, timeout=5.0):
+        # Pending alerts stay in queue_file; a send already in flight may finish.
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
@@ -0,0 +1,165 @@
+import argparse
+import tempfile
+import time
+import types
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from motion_engine import MotionDetector, BLOB_EXTRACTORS, MOTION_BACKENDS
+
+# -----------------------------------------------------------------------------
+# Micro-benchmarks for the motion pipeline
+# -----------------------------------------------------------------------------
+# Runs MotionDetector.step() on frames held in memory, so neither capture nor
+# decoding is measured. Frames come from --clip, or are synthetic: sensor noise
+# plus a moving block, at --width x --height.
+#
+#   python benchmark.py alloc --width 1920 --height 1080
+#   python benchmark.py alloc --clip reference.avi
+#   python benchmark.py throughput --clip reference.avi
+#   python benchmark.py blobs --width 1920 --height 1080
+#   python benchmark.py backends --clip reference.avi
+
+def load_frames(clip=None, frames=120, width=1280, height=720):
+    if clip:
+        capture = cv2.VideoCapture(clip)
+        loaded = []
+        while len(loaded) < frames:
+            ret, frame = capture.read()
+            if not ret:
+                break
+            loaded.append(frame)
+        capture.release()
+        if not loaded:
+            raise SystemExit(f"Could not read any frames from {clip}")
+        return loaded
+    rng = np.random.default_rng(0)
+    base = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    loaded = []
+    for index in range(frames):
+        frame = base.copy()
+        noise = rng.integers(-6, 7, (height, width, 3), dtype=np.int16)
+        frame = np.clip(frame.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+        x = (index * 8) % max(1, width - 80)
+        cv2.rectangle(frame, (x, height // 3), (x + 80, height // 3 + 120), (255, 255, 255), -1)
+        loaded.append(frame)
+    return loaded
+
+def make_detector(target_folder, **options):
+    # No pre-roll: the benchmarks time the analysis pipeline only.
+    options.setdefault('pre_roll_seconds', 0)
+    return MotionDetector(None, target_folder, **options)
+
+def legacy_step(frame1, frame2, sensitivity=500):
+    # The original pipeline (BGR difference, fresh arrays every frame), kept
+    # only as a reference point.
+    diff = cv2.absdiff(frame1, frame2)
+    gray = cv2.cvtColor(diff, cv2.COLOR_BGR2GRAY)
+    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+    _, thresh = cv2.threshold(blurred, 25, 255, cv2.THRESH_BINARY)
+    dilated = cv2.dilate(thresh, None, iterations=2)
+    contours, _ = cv2.findContours(dilated, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    return [c for c in contours if cv2.contourArea(c) >= sensitivity]
+
+def frame_allocations(run_frame, frames):
+    # tracemalloc sees numpy/OpenCV image buffers; the peak above the steady
+    # state while a frame is processed, in units of one grayscale frame, is the
+    # number of full-frame scratch images that frame needed.
+    gray_bytes = frames[0].shape[0] * frames[0].shape[1]
+    run_frame(0)
+    tracemalloc.start()
+    counts = []
+    for index in range(1, len(frames)):
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        run_frame(index)
+        _, peak = tracemalloc.get_traced_memory()
+        counts.append((peak - current) / gray_bytes)
+    tracemalloc.stop()
+    return float(np.mean(counts)), float(np.max(counts))
+
+def bench_alloc(frames):
+    with tempfile.TemporaryDirectory() as folder:
+        # A huge sensitivity keeps the detector from recording or drawing on frames.
+        detector = make_detector(folder, sensitivity=10 ** 9)
+        mean, worst = frame_allocations(lambda i: detector.step(frames[i]), frames)
+        print(f"MotionDetector.step : {mean:5.2f} frame buffers/frame (worst {worst:.2f}), "
+              f"buffer reallocations: {detector.buffers.allocations}")
+    mean, worst = frame_allocations(lambda i: legacy_step(frames[i - 1], frames[i]) if i else None, frames)
+    print(f"legacy pipeline     : {mean:5.2f} frame buffers/frame (worst {worst:.2f})")
+
+def frames_per_second(run_frame, frames):
+    run_frame(0)
+    started = time.perf_counter()
+    for index in range(1, len(frames)):
+        run_frame(index)
+    return (len(frames) - 1) / (time.perf_counter() - started)
+
+def bench_throughput(frames, sensitivity=500):
+    # Like for like: both at full resolution, with the legacy sensitivity and
+    # dilation plus contours on every frame. Clips never start, so nothing is
+    # encoded. The legacy pipeline goes first, as step() draws on the frames.
+    before = frames_per_second(lambda i: legacy_step(frames[i - 1], frames[i], sensitivity) if i else None, frames)
+    with tempfile.TemporaryDirectory() as folder:
+        detector = make_detector(folder, sensitivity=sensitivity, analysis_width=0, quiet_fast_path=False,
+                                 confirm_frames=10 ** 9)
+        after = frames_per_second(lambda i: detector.step(frames[i]), frames)
+    print(f"legacy pipeline     : {before:7.1f} frames/s")
+    print(f"MotionDetector.step : {after:7.1f} frames/s ({after / before:.2f}x)")
+
+def noise_masks(frames, density=0.08, count=30):
+    # Night-footage style masks: thousands of small specks plus a few real blobs.
+    rng = np.random.default_rng(1)
+    height, width = frames[0].shape[:2]
+    masks = []
+    for index in range(count):
+        mask = np.where(rng.random((height, width)) < density, 255, 0).astype(np.uint8)
+        x = (index * 16) % max(1, width - 120)
+        cv2.rectangle(mask, (x, height // 3), (x + 120, height // 3 + 160), 255, -1)
+        masks.append(mask)
+    return masks
+
+def bench_blobs(frames):
+    masks = noise_masks(frames)
+    buffers = types.SimpleNamespace(labels=np.empty(masks[0].shape, dtype=np.int32))
+    for name, extract in sorted(BLOB_EXTRACTORS.items()):
+        started = time.perf_counter()
+        found = [len(extract(mask, 500, buffers)) for mask in masks]
+        elapsed = (time.perf_counter() - started) / len(masks)
+        print(f"{name:10s}: {elapsed * 1000:7.2f} ms/frame, {np.mean(found):.1f} blobs >= 500 px")
+    contours = np.mean([len(cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)[0]) for mask in masks])
+    print(f"raw contours per noise mask: {contours:.0f}")
+
+def bench_backends(frames):
+    with tempfile.TemporaryDirectory() as folder:
+        for name in MOTION_BACKENDS:
+            detector = make_detector(folder, sensitivity=10 ** 9, backend=name)
+            fps = frames_per_second(lambda i: detector.step(frames[i]), frames)
+            print(f"{name:16s}: {detector.backend.average_cost_ms:6.2f} ms/frame in backend, "
+                  f"{fps:7.1f} frames/s end to end")
+
+BENCHMARKS = {
+    'alloc': bench_alloc,
+    'backends': bench_backends,
+    'blobs': bench_blobs,
+    'throughput': bench_throughput
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="Motion pipeline micro-benchmarks")
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--clip', help="reference clip to read frames from")
+    parser.add_argument('--frames', type=int, default=120)
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    args = parser.parse_args()
+    frames = load_frames(args.clip, args.frames, args.width, args.height)
+    print(f"{len(frames)} frames at {frames[0].shape[1]}x{frames[0].shape[0]}")
+    started = time.perf_counter()
+    BENCHMARKS[args.benchmark](frames)
+    print(f"done in {time.perf_counter() - started:.1f}s")
+
+if __name__ == '__main__':
+    main()
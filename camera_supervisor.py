@@ -0,0 +1,304 @@
+import os
+import sys
+import time
+import queue
+import logging
+import threading
+import importlib.machinery
+import multiprocessing
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from motion_engine import MotionDetector, detector_options
+
+STATS_INTERVAL = 1.0
+
+# -----------------------------------------------------------------------------
+# Shared-Memory Frame Slot (worker -> UI preview without pickling frames)
+# -----------------------------------------------------------------------------
+# Layout: an int64 header followed by `buffers` frame buffers of equal capacity.
+# header[0] is the sequence counter; frame N lives in buffer N % buffers and its
+# shape is stored at header[3 + 3 * buffer]. The single writer fills the next
+# buffer and only then bumps the counter, so a reader always sees a complete
+# frame. With three buffers the writer can run two frames ahead before it
+# touches the buffer a reader is using; is_current() tells the reader if it did.
+SLOT_HEADER_FIELDS = 16
+
+class SharedFrameSlot:
+    def __init__(self, name, max_width=1920, max_height=1080, buffers=3, create=False):
+        self.name = name
+        self.created = create
+        if create:
+            self.capacity = max_width * max_height * 3
+            self.buffers = buffers
+            size = SLOT_HEADER_FIELDS * 8 + buffers * self.capacity
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        else:
+            self.shm = self._attach(name)
+        self.header = np.ndarray((SLOT_HEADER_FIELDS,), dtype=np.int64, buffer=self.shm.buf)
+        if create:
+            self.header[:] = 0
+            self.header[1] = self.buffers
+            self.header[2] = self.capacity
+        else:
+            self.buffers = int(self.header[1])
+            self.capacity = int(self.header[2])
+        self._warned = False
+
+    @staticmethod
+    def _attach(name):
+        # Only the creating process unlinks the segment. Before Python 3.13
+        # attaching always registers it with the resource tracker; workers
+        # share the supervisor's tracker, which already holds the name, so
+        # that is a no-op. Unregistering here would drop the supervisor's
+        # own registration and make its unlink() fail in the tracker.
+        try:
+            return shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            return shared_memory.SharedMemory(name=name)
+
+    def _view(self, index, shape):
+        offset = SLOT_HEADER_FIELDS * 8 + index * self.capacity
+        return np.ndarray(shape, dtype=np.uint8, buffer=self.shm.buf, offset=offset)
+
+    def write(self, frame):
+        height, width = frame.shape[:2]
+        channels = frame.shape[2] if frame.ndim == 3 else 1
+        if height * width * channels > self.capacity:
+            # Too big for the slot: shrink straight into shared memory.
+            scale = (self.capacity / float(height * width * channels)) ** 0.5
+            width, height = max(1, int(width * scale)), max(1, int(height * scale))
+            if not self._warned:
+                logging.warning("Frame too large for slot %s, previewing at %dx%d", self.name, width, height)
+                self._warned = True
+        seq = int(self.header[0]) + 1
+        index = seq % self.buffers
+        target = self._view(index, (height, width, channels) if channels > 1 else (height, width))
+        if target.shape[:2] == frame.shape[:2]:
+            np.copyto(target, frame)
+        else:
+            cv2.resize(frame, (width, height), dst=target, interpolation=cv2.INTER_AREA)
+        self.header[3 + 3 * index:6 + 3 * index] = (height, width, channels)
+        self.header[0] = seq
+        return seq
+
+    @property
+    def sequence(self):
+        return int(self.header[0])
+
+    def latest(self):
+        # Returns (seq, frame) where frame is a view straight into shared memory
+        # (no copy), or (0, None) before the first frame arrives.
+        seq = int(self.header[0])
+        if seq == 0:
+            return 0, None
+        index = seq % self.buffers
+        height, width, channels = (int(v) for v in self.header[3 + 3 * index:6 + 3 * index])
+        return seq, self._view(index, (height, width, channels) if channels > 1 else (height, width))
+
+    def is_current(self, seq):
+        return int(self.header[0]) - seq < self.buffers - 1
+
+    def close(self):
+        # Views into the buffer must be gone before the mapping can close.
+        self.header = None
+        try:
+            self.shm.close()
+        except BufferError:
+            logging.warning("Frame slot %s still in use, leaving it mapped", self.name)
+            return
+        if self.created:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+# -----------------------------------------------------------------------------
+# Camera Worker (runs in its own process, one per stream)
+# -----------------------------------------------------------------------------
+# A camera definition is a plain dict, e.g.
+#   {"name": "porch", "source": "http://192.168.1.20:4747/video",
+#    "sensitivity": 500, "analysis_width": 320, "cpu_affinity": [2], "target_folder": "users_data/x/Target",
+#    "preview_slot": "<SharedFrameSlot name, filled in by the supervisor>"}
+# Workers never touch the UI; everything goes back to the parent as small dicts
+# on the events queue: {"camera": name, "event": kind, "time": ..., **fields}.
+def run_camera_worker(camera, events, stop_event, log_file=None):
+    name = camera['name']
+    # Nothing from the app is inherited (see start_worker), logging included.
+    if log_file and not logging.getLogger().handlers:
+        logging.basicConfig(filename=log_file, level=logging.DEBUG,
+                            format='%(asctime)s - %(levelname)s - %(message)s')
+    affinity = camera.get('cpu_affinity')
+    if affinity and hasattr(os, 'sched_setaffinity'):
+        try:
+            os.sched_setaffinity(0, set(affinity))
+        except (OSError, ValueError) as e:
+            logging.warning("Could not pin camera %s to CPUs %s: %s", name, affinity, e)
+
+    def report(event, **fields):
+        fields.update(camera=name, event=event, time=time.time())
+        try:
+            events.put_nowait(fields)
+        except queue.Full:
+            pass
+
+    def fail(code):
+        # The parent is still polling, so let the error event reach it first.
+        events.close()
+        events.join_thread()
+        sys.exit(code)
+
+    slot = SharedFrameSlot(camera['preview_slot']) if camera.get('preview_slot') else None
+
+    detector = MotionDetector(camera['source'], camera['target_folder'],
+                              name=name,
+                              **detector_options(camera),
+                              on_status=lambda d, state: report('status', state=state),
+                              on_motion_start=lambda d, v, i: report('motion_start', video_path=v, image_path=i),
+                              on_motion_end=lambda d, v, i: report('motion_end', video_path=v, image_path=i),
+                              on_frame=(lambda d, frame: slot.write(frame)) if slot else None,
+                              on_error=lambda d, title, message: report('error', title=title, message=message))
+    if not detector.open():
+        if slot:
+            slot.close()
+        fail(1)
+    detector.stats()
+    last_report = time.time()
+    try:
+        while not stop_event.is_set() and detector.step():
+            now = time.time()
+            if now - last_report >= STATS_INTERVAL:
+                report('stats', **detector.stats())
+                last_report = now
+    finally:
+        detector.close()
+        if slot:
+            slot.close()
+    # Leaving the loop without being asked to means the stream died.
+    if not stop_event.is_set():
+        fail(2)
+    # The parent stops reading once it has asked workers to stop.
+    events.cancel_join_thread()
+
+# -----------------------------------------------------------------------------
+# Worker Start-Up (a clean interpreter per camera)
+# -----------------------------------------------------------------------------
+# Workers use the 'spawn' start method on every platform: forking the app would
+# copy its running threads, GL context and OpenCV state into each worker. A
+# spawned child normally runs the parent's main script again first (as
+# __mp_main__), and the app script opens a Kivy window, starts the audio mixer
+# and builds the mail dispatcher at import; workers need none of it.
+# multiprocessing skips that step when __main__'s spec is named '__main__' (as
+# under `python -m`), so that is how the parent's main module looks while a
+# worker is being started.
+_start_lock = threading.Lock()
+
+def start_worker(process):
+    main = sys.modules['__main__']
+    with _start_lock:
+        spec = getattr(main, '__spec__', None)
+        main.__spec__ = importlib.machinery.ModuleSpec('__main__', None)
+        try:
+            process.start()
+        finally:
+            main.__spec__ = spec
+
+# -----------------------------------------------------------------------------
+# Camera Supervisor (spawns, watches and restarts camera workers)
+# -----------------------------------------------------------------------------
+class CameraSupervisor:
+    def __init__(self, cameras, restart_delay=2.0, max_restart_delay=60.0, preview=True,
+                 log_file='motion_detection.log'):
+        self.cameras = {camera['name']: dict(camera) for camera in cameras}
+        self.slots = {}
+        if preview:
+            for index, (name, camera) in enumerate(self.cameras.items()):
+                slot = SharedFrameSlot(f"motion_{os.getpid()}_{index}",
+                                       max_width=camera.get('preview_max_width', 1920),
+                                       max_height=camera.get('preview_max_height', 1080),
+                                       create=True)
+                camera['preview_slot'] = slot.name
+                self.slots[name] = slot
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.log_file = log_file
+        self.ctx = multiprocessing.get_context('spawn')
+        self.events = self.ctx.Queue(maxsize=1000)
+        self.stop_event = self.ctx.Event()
+        self.workers = {}
+        self.stats = {}
+        self.lock = threading.Lock()
+        self._monitor_thread = None
+
+    def start(self):
+        self.stop_event.clear()
+        with self.lock:
+            for name in self.cameras:
+                self._spawn(name)
+        self._monitor_thread = threading.Thread(target=self._monitor, daemon=True)
+        self._monitor_thread.start()
+        return self
+
+    def _spawn(self, name):
+        process = self.ctx.Process(target=run_camera_worker, name=f"camera-{name}",
+                                   args=(self.cameras[name], self.events, self.stop_event, self.log_file),
+                                   daemon=True)
+        start_worker(process)
+        worker = self.workers.setdefault(name, {'restarts': 0, 'delay': self.restart_delay})
+        worker['process'] = process
+        worker['started'] = time.time()
+        worker['next_start'] = None
+        logging.info("Started camera worker %s (pid %s)", name, process.pid)
+
+    def _monitor(self):
+        while not self.stop_event.wait(0.5):
+            with self.lock:
+                for name, worker in self.workers.items():
+                    process = worker['process']
+                    if process.is_alive():
+                        continue
+                    now = time.time()
+                    if worker['next_start'] is None:
+                        # Back off on workers that keep dying; reset once one stays up.
+                        if now - worker['started'] > self.max_restart_delay:
+                            worker['delay'] = self.restart_delay
+                        else:
+                            worker['delay'] = min(worker['delay'] * 2, self.max_restart_delay)
+                        worker['next_start'] = now + worker['delay']
+                        self.stats.pop(name, None)
+                        logging.error("Camera worker %s exited with code %s, restarting in %.0fs",
+                                      name, process.exitcode, worker['delay'])
+                    elif now >= worker['next_start']:
+                        worker['restarts'] += 1
+                        self._spawn(name)
+
+    def poll_events(self, max_events=200):
+        events = []
+        for _ in range(max_events):
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if event['event'] == 'stats':
+                self.stats[event['camera']] = event
+            events.append(event)
+        return events
+
+    def stop(self, timeout=5.0):
+        self.stop_event.set()
+        if self._monitor_thread:
+            self._monitor_thread.join(timeout)
+        with self.lock:
+            deadline = time.time() + timeout
+            for worker in self.workers.values():
+                worker['process'].join(max(0.0, deadline - time.time()))
+            for name, worker in self.workers.items():
+                if worker['process'].is_alive():
+                    logging.warning("Camera worker %s did not stop, terminating", name)
+                    worker['process'].terminate()
+        for slot in self.slots.values():
+            slot.close()
+        self.slots = {}
+        self.stats = {}
@@ -0,0 +1,164 @@
+import os
+import struct
+import logging
+import threading
+import collections
+
+import cv2
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# Frame Index (byte offset of every frame in an MJPG AVI)
+# -----------------------------------------------------------------------------
+# Every MJPG frame is a self-contained JPEG chunk in the AVI's 'movi' list, so
+# with its offset and size any frame can be decoded directly with imdecode,
+# instead of asking VideoCapture to seek. The index lives next to the clip in
+# `<clip>.frames` as (uint64 offset, uint32 size) pairs. It is written when a
+# recording finishes, or built on first open for older clips. Clips in other
+# codecs (XVID, mp4v) need their neighbours to decode and get no index.
+FRAME_ENTRY = struct.Struct('<QI')
+RIFF_HEADER = struct.Struct('<4sI')
+
+def clip_frame_index_path(video_path):
+    return os.path.splitext(video_path)[0] + '.frames'
+
+def scan_avi_frames(video_path):
+    frames = []
+    with open(video_path, 'rb') as f:
+        def walk(start, end, in_movi):
+            position = start
+            while position + RIFF_HEADER.size <= end:
+                f.seek(position)
+                header = f.read(12)
+                if len(header) < RIFF_HEADER.size:
+                    break
+                fourcc, size = RIFF_HEADER.unpack(header[:8])
+                if fourcc in (b'RIFF', b'LIST'):
+                    # A recording cut short may never have had its sizes filled in.
+                    if size == 0 or position + 8 + size > end:
+                        size = end - position - 8
+                    walk(position + 12, position + 8 + size, in_movi or header[8:12] == b'movi')
+                elif in_movi and fourcc[2:] in (b'dc', b'db') and size:
+                    frames.append((position + 8, size))
+                position += 8 + size + (size & 1)
+        walk(0, os.fstat(f.fileno()).st_size, False)
+        if frames:
+            f.seek(frames[0][0])
+            if f.read(2) != b'\xff\xd8':
+                return None
+    return frames or None
+
+def build_frame_index(video_path):
+    try:
+        frames = scan_avi_frames(video_path)
+    except (OSError, struct.error) as e:
+        logging.warning(f"Could not index frames of {video_path}: {e}")
+        return None
+    if frames is None:
+        return None
+    try:
+        with open(clip_frame_index_path(video_path), 'wb') as file:
+            file.write(b''.join(FRAME_ENTRY.pack(offset, size) for offset, size in frames))
+    except OSError as e:
+        logging.warning(f"Could not save frame index for {video_path}: {e}")
+    return frames
+
+def load_frame_index(video_path):
+    path = clip_frame_index_path(video_path)
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(video_path):
+        try:
+            with open(path, 'rb') as file:
+                return list(FRAME_ENTRY.iter_unpack(file.read())) or None
+        except (OSError, struct.error) as e:
+            logging.warning(f"Could not read frame index {path}, rebuilding: {e}")
+    if video_path.lower().endswith('.avi'):
+        return build_frame_index(video_path)
+    return None
+
+# -----------------------------------------------------------------------------
+# Frame Cache (recently decoded frames, least recently used evicted first)
+# -----------------------------------------------------------------------------
+class FrameCache:
+    def __init__(self, max_bytes=192 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.frames = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, index):
+        frame = self.frames.get(index)
+        if frame is None:
+            self.misses += 1
+            return None
+        self.frames.move_to_end(index)
+        self.hits += 1
+        return frame
+
+    def put(self, index, frame):
+        if index in self.frames:
+            return
+        self.frames[index] = frame
+        self.bytes += frame.nbytes
+        while self.bytes > self.max_bytes and len(self.frames) > 1:
+            _, evicted = self.frames.popitem(last=False)
+            self.bytes -= evicted.nbytes
+
+    def clear(self):
+        self.frames.clear()
+        self.bytes = 0
+
+# -----------------------------------------------------------------------------
+# Clip Frame Reader (random access to a clip's frames)
+# -----------------------------------------------------------------------------
+# read(index) decodes straight from the frame index when the clip has one, and
+# otherwise falls back to VideoCapture, seeking only when the request is not
+# the next frame. Either way decoded frames go through the LRU cache, so
+# stepping back and forth or scrubbing over frames already seen costs nothing.
+# Safe to share between a decoder thread and the UI.
+class ClipFrameReader:
+    def __init__(self, video_path, cache_bytes=192 * 1024 * 1024):
+        self.video_path = video_path
+        self.lock = threading.Lock()
+        self.cache = FrameCache(cache_bytes)
+        self.capture = cv2.VideoCapture(video_path)
+        self.frame_count = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT)) if self.capture.isOpened() else 0
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) if self.capture.isOpened() else 0.0
+        self.index = load_frame_index(video_path) if self.capture.isOpened() else None
+        self.file = open(video_path, 'rb') if self.index else None
+        if self.index:
+            self.frame_count = len(self.index)
+        self._next_position = 0
+
+    def is_opened(self):
+        return self.capture is not None and self.capture.isOpened()
+
+    def read(self, index):
+        with self.lock:
+            frame = self.cache.get(index)
+            if frame is not None:
+                return frame
+            if self.index is not None:
+                if not 0 <= index < len(self.index):
+                    return None
+                offset, size = self.index[index]
+                self.file.seek(offset)
+                frame = cv2.imdecode(np.frombuffer(self.file.read(size), dtype=np.uint8), cv2.IMREAD_COLOR)
+            elif self.is_opened():
+                if index != self._next_position:
+                    self.capture.set(cv2.CAP_PROP_POS_FRAMES, index)
+                ret, frame = self.capture.read()
+                self._next_position = index + 1 if ret else -1
+                frame = frame if ret else None
+            if frame is not None:
+                self.cache.put(index, frame)
+            return frame
+
+    def release(self):
+        with self.lock:
+            self.cache.clear()
+            if self.capture is not None:
+                self.capture.release()
+            if self.file is not None:
+                self.file.close()
+                self.file = None
@@ -0,0 +1,175 @@
+import os
+import json
+import struct
+import logging
+import threading
+
+# -----------------------------------------------------------------------------
+# Append-Only Email Log (JSON lines plus an offset index)
+# -----------------------------------------------------------------------------
+# Each sent mail is one JSON line appended to `<name>.jsonl`; nothing is ever
+# rewritten. `<name>.idx` holds the byte offset of every line as a little-endian
+# uint64, so entry i starts at idx[i] and a page of entries costs one read of
+# the index plus one read per entry, however long the history is.
+#
+# Appends are flushed at once (other readers see them) but only fsynced every
+# `sync_every` entries, on close(), and otherwise by a timer at most
+# `sync_interval` seconds after the first unsynced append. After a crash
+# a torn last line is cut off and index entries missing for complete lines are
+# rebuilt when the log is next opened.
+OFFSET = struct.Struct('<Q')
+
+class EmailLog:
+    def __init__(self, path, sync_every=8, sync_interval=2.0):
+        base = os.path.splitext(path)[0]
+        self.path = base + '.jsonl'
+        self.index_path = base + '.idx'
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.lock = threading.Lock()
+        self._unsynced = 0
+        self._sync_timer = None
+        self._migrate(base + '.json')
+        self.log = open(self.path, 'a+b')
+        self.index = open(self.index_path, 'a+b')
+        self._recover()
+
+    def _migrate(self, legacy_path):
+        # One-off conversion of the old rewrite-everything email_log.json.
+        if not os.path.exists(legacy_path) or os.path.exists(self.path):
+            return
+        try:
+            with open(legacy_path, 'r') as file:
+                entries = json.load(file)
+        except (OSError, ValueError) as e:
+            logging.error("Could not migrate email log %s: %s", legacy_path, e)
+            return
+        with open(self.path, 'wb') as log, open(self.index_path, 'wb') as index:
+            for entry in entries:
+                index.write(OFFSET.pack(log.tell()))
+                log.write(json.dumps(entry).encode('utf-8') + b'\n')
+            log.flush()
+            os.fsync(log.fileno())
+            index.flush()
+            os.fsync(index.fileno())
+        os.replace(legacy_path, legacy_path + '.migrated')
+        logging.info("Migrated %d entries from %s to %s", len(entries), legacy_path, self.path)
+
+    def _recover(self):
+        log_size = os.path.getsize(self.path)
+        if log_size:
+            # Drop a torn final line.
+            self.log.seek(max(0, log_size - 4096))
+            tail = self.log.read()
+            if not tail.endswith(b'\n'):
+                cut = tail.rfind(b'\n')
+                log_size = log_size - len(tail) + cut + 1 if cut >= 0 else max(0, log_size - len(tail))
+                self.log.truncate(log_size)
+                logging.warning("Truncated torn entry at the end of %s", self.path)
+        index_size = os.path.getsize(self.index_path)
+        count = index_size // OFFSET.size
+        # Drop index entries past the end of the log, then index any lines the
+        # index is missing.
+        while count:
+            last = self._offset(count - 1)
+            if last < log_size:
+                break
+            count -= 1
+        if count * OFFSET.size != index_size:
+            self.index.truncate(count * OFFSET.size)
+        position = self._offset(count - 1) if count else 0
+        if count:
+            self.log.seek(position)
+            position += len(self.log.readline())
+        self.log.seek(position)
+        rebuilt = 0
+        while position < log_size:
+            self.index.write(OFFSET.pack(position))
+            position += len(self.log.readline())
+            rebuilt += 1
+        if rebuilt:
+            self.index.flush()
+            logging.warning("Rebuilt %d index entries for %s", rebuilt, self.path)
+
+    def _offset(self, position):
+        self.index.seek(position * OFFSET.size)
+        return OFFSET.unpack(self.index.read(OFFSET.size))[0]
+
+    def __len__(self):
+        with self.lock:
+            return os.path.getsize(self.index_path) // OFFSET.size
+
+    def append(self, entry):
+        line = json.dumps(entry).encode('utf-8') + b'\n'
+        with self.lock:
+            # The log comes first: an index entry must never point past it.
+            self.log.seek(0, os.SEEK_END)
+            offset = self.log.tell()
+            self.log.write(line)
+            self.log.flush()
+            self.index.write(OFFSET.pack(offset))
+            self.index.flush()
+            self._unsynced += 1
+            if self._unsynced >= self.sync_every:
+                self._sync()
+            elif self._sync_timer is None:
+                self._sync_timer = threading.Timer(self.sync_interval, self._timed_sync)
+                self._sync_timer.daemon = True
+                self._sync_timer.start()
+
+    def _timed_sync(self):
+        with self.lock:
+            self._sync_timer = None
+            if self._unsynced and not self.log.closed:
+                self._sync()
+
+    def _sync(self):
+        os.fsync(self.log.fileno())
+        os.fsync(self.index.fileno())
+        self._unsynced = 0
+        if self._sync_timer is not None:
+            self._sync_timer.cancel()
+            self._sync_timer = None
+
+    def read_page(self, page, page_size=50):
+        # Entries for page `page` (0 = newest), newest first.
+        with self.lock:
+            count = os.path.getsize(self.index_path) // OFFSET.size
+            stop = count - page * page_size
+            start = max(0, stop - page_size)
+            if stop <= 0:
+                return []
+            self.index.seek(start * OFFSET.size)
+            data = self.index.read((stop - start) * OFFSET.size)
+            entries = []
+            for (offset,) in reversed(list(OFFSET.iter_unpack(data))):
+                self.log.seek(offset)
+                try:
+                    entries.append(json.loads(self.log.readline()))
+                except ValueError:
+                    logging.warning("Skipping unreadable entry at offset %d in %s", offset, self.path)
+            return entries
+
+    def close(self):
+        with self.lock:
+            if self._unsynced:
+                self._sync()
+            self.log.close()
+            self.index.close()
+
+# One EmailLog per file, shared by the writer and the log viewer.
+_logs = {}
+_logs_lock = threading.Lock()
+
+def open_email_log(path):
+    key = os.path.abspath(os.path.splitext(path)[0])
+    with _logs_lock:
+        if key not in _logs:
+            _logs[key] = EmailLog(path)
+        return _logs[key]
+
+def close_email_logs():
+    with _logs_lock:
+        for log in _logs.values():
+            log.close()
+        _logs.clear()
@@ -0,0 +1,191 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+# -----------------------------------------------------------------------------
+# Motion Event Index (SQLite, one row per recorded event)
+# -----------------------------------------------------------------------------
+# The recorder adds a row when a clip starts and fills in its end and size once
+# the clip is closed; the media browser pages through rows with indexed queries
+# instead of listing and stat()ing the Target folder. One database per Target folder, shared by every camera process (WAL
+# mode lets them write while the UI reads). Deleting a clip or snapshot clears
+# its path; a row with neither left is removed.
+EVENT_INDEX_FILE = '.events.db'
+# Seconds an event's clip may take to appear before the event is treated as
+# having no clip.
+OPEN_CLIP_GRACE = 60.0
+
+# Sort column and direction per list order. The id tie-break runs the same way
+# as the column, so SQLite walks the index instead of sorting.
+EVENT_ORDERS = {
+    'newest': ('start', 'DESC'),
+    'oldest': ('start', 'ASC'),
+    'name_az': ('name', 'ASC'),
+    'name_za': ('name', 'DESC')
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    camera TEXT,
+    start REAL NOT NULL,
+    end REAL,
+    duration REAL,
+    video_path TEXT UNIQUE,
+    image_path TEXT,
+    peak_area INTEGER,
+    size INTEGER
+);
+CREATE INDEX IF NOT EXISTS events_start ON events (start);
+CREATE INDEX IF NOT EXISTS events_name ON events (name);
+CREATE INDEX IF NOT EXISTS events_image ON events (image_path);
+CREATE INDEX IF NOT EXISTS events_open ON events (end) WHERE end IS NULL;
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+class EventIndex:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=10.0, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.lock, self.db:
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.executescript(SCHEMA)
+
+    def add_event(self, video_path, image_path, start, camera=None):
+        name = os.path.splitext(os.path.basename(video_path or image_path))[0]
+        with self.lock, self.db:
+            self.db.execute(
+                'INSERT OR IGNORE INTO events (name, camera, start, video_path, image_path) VALUES (?, ?, ?, ?, ?)',
+                (name, camera, start, video_path, image_path))
+
+    def finish_event(self, video_path, end, peak_area=0, size=None):
+        with self.lock, self.db:
+            self.db.execute('UPDATE events SET end = ?, duration = ? - start, peak_area = ?, size = ? '
+                            'WHERE video_path = ?', (end, end, peak_area, size, video_path))
+
+    def page(self, order='newest', after=None, limit=50):
+        # Keyset paging: `after` is the last event of the previous page, so
+        # events added or removed in the meantime never shift later pages.
+        column, direction = EVENT_ORDERS.get(order, EVENT_ORDERS['newest'])
+        where, args = '', ()
+        if after is not None:
+            where = f"WHERE ({column}, id) {'<' if direction == 'DESC' else '>'} (?, ?)"
+            args = (after[column], after['id'])
+        with self.lock:
+            return [dict(row) for row in self.db.execute(
+                f'SELECT * FROM events {where} ORDER BY {column} {direction}, id {direction} LIMIT ?',
+                args + (limit,))]
+
+    def find(self, path):
+        with self.lock:
+            row = self.db.execute('SELECT * FROM events WHERE video_path = ? OR image_path = ?',
+                                  (path, path)).fetchone()
+        return dict(row) if row else None
+
+    def count(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM events').fetchone()[0]
+
+    def remove_media(self, path):
+        with self.lock, self.db:
+            self.db.execute('UPDATE events SET video_path = NULL, size = NULL WHERE video_path = ?', (path,))
+            self.db.execute('UPDATE events SET image_path = NULL WHERE image_path = ?', (path,))
+            self.db.execute('DELETE FROM events WHERE video_path IS NULL AND image_path IS NULL')
+
+    def import_folder(self, folder, video_extensions, read_timestamps=None):
+        # Indexes what the recorders did not: clips from before the index
+        # existed or from cameras with record_events off, snapshots whose clip
+        # failed, and clips cut off by a crash (left without an end). Pairs
+        # motion_<stamp>.<ext> with image_<stamp>.jpg as the recorder names
+        # them. Only runs when the folder changed since the last call, and
+        # then only looks at files modified after it.
+        if not os.path.isdir(folder):
+            return 0
+        folder_mtime = os.path.getmtime(folder)
+        with self.lock:
+            row = self.db.execute("SELECT value FROM meta WHERE key = 'folder_mtime'").fetchone()
+            open_clips = self.db.execute(
+                'SELECT video_path, start FROM events WHERE end IS NULL AND video_path IS NOT NULL').fetchall()
+        last_mtime = float(row[0]) if row else None
+        for video_path, start in open_clips:
+            self._close_open_clip(video_path, start, read_timestamps)
+        if last_mtime == folder_mtime:
+            return 0
+        files = {}
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_file() and (last_mtime is None or entry.stat().st_mtime >= last_mtime):
+                    files[entry.name] = entry.path
+        rows = []
+        for file, video_path in files.items():
+            stem, extension = os.path.splitext(file)
+            if not (file.startswith('motion_') and extension in video_extensions):
+                continue
+            image_path = os.path.join(folder, f"image_{stem[len('motion_'):]}.jpg")
+            image_path = image_path if os.path.exists(image_path) else None
+            timestamps = read_timestamps(video_path) if read_timestamps else None
+            end = os.path.getmtime(video_path)
+            start = timestamps[0] if timestamps else end
+            end = timestamps[-1] if timestamps else end
+            rows.append((stem, None, start, end, end - start, video_path, image_path, None,
+                         os.path.getsize(video_path)))
+        indexed = {row[6] for row in rows if row[6]}
+        for file, image_path in files.items():
+            if file.startswith('image_') and file.endswith('.jpg') and image_path not in indexed \
+                    and self.find(image_path) is None:
+                start = os.path.getmtime(image_path)
+                rows.append((os.path.splitext(file)[0], None, start, start, 0.0, None, image_path, None, None))
+        with self.lock, self.db:
+            before = self.db.total_changes
+            self.db.executemany(
+                'INSERT OR IGNORE INTO events (name, camera, start, end, duration, video_path, image_path, '
+                'peak_area, size) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            added = self.db.total_changes - before
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('folder_mtime', ?)",
+                            (repr(folder_mtime),))
+        if added:
+            logging.info("Indexed %d clips and snapshots in %s", added, folder)
+        return added
+
+    def _close_open_clip(self, video_path, start, read_timestamps=None):
+        # A clip still being recorded gets its final values when it closes;
+        # until then this shows it as far as it got.
+        if not os.path.exists(video_path):
+            # The writer opens the file shortly after the row is added.
+            if start < time.time() - OPEN_CLIP_GRACE:
+                self.remove_media(video_path)
+            return
+        timestamps = read_timestamps(video_path) if read_timestamps else None
+        end = timestamps[-1] if timestamps else os.path.getmtime(video_path)
+        with self.lock, self.db:
+            self.db.execute('UPDATE events SET end = ?, duration = ? - start, size = ? '
+                            'WHERE video_path = ? AND end IS NULL',
+                            (end, end, os.path.getsize(video_path), video_path))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+# One index per folder per process.
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def open_event_index(folder):
+    key = os.path.abspath(folder)
+    with _indexes_lock:
+        if key not in _indexes:
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            _indexes[key] = EventIndex(os.path.join(folder, EVENT_INDEX_FILE))
+        return _indexes[key]
+
+def close_event_indexes():
+    with _indexes_lock:
+        for index in _indexes.values():
+            index.close()
+        _indexes.clear()
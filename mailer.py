@@ -0,0 +1,369 @@
+import io
+import os
+import time
+import uuid
+import base64
+import smtplib
+import logging
+import tempfile
+import threading
+import email.utils
+from email.header import Header
+
+import cv2
+import numpy as np
+
+from motion_engine import read_clip_timestamps
+
+# -----------------------------------------------------------------------------
+# SMTP Session (one kept-alive connection reused by every alert)
+# -----------------------------------------------------------------------------
+# Connects and logs in on first use and keeps the connection open. Before a
+# send on a connection idle for more than `noop_interval` seconds, a NOOP checks
+# it is still alive; a dead connection is replaced, and a send that fails
+# because the server dropped the connection is retried once on a fresh one.
+# SMTP error replies are raised as they are (smtplib's exceptions subclass
+# OSError, so they are told apart from socket errors explicitly);
+# permanent_failure() says whether retrying one can ever help.
+# Login is skipped without a password, so the session also works against a
+# local test server, e.g.
+#   python -m aiosmtpd -n -l localhost:8025
+#   SMTPSession('localhost', 8025, use_ssl=False)
+class SMTPSession:
+    def __init__(self, host, port, username=None, password=None, use_ssl=True, timeout=30.0, noop_interval=60.0):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self.noop_interval = noop_interval
+        self.lock = threading.Lock()
+        self.server = None
+        self.last_used = 0.0
+        self.connections = 0
+        self.messages_sent = 0
+
+    def _connect(self):
+        if self.use_ssl:
+            server = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.username and self.password:
+                server.login(self.username, self.password)
+        except Exception:
+            server.close()
+            raise
+        self.server = server
+        self.last_used = time.time()
+        self.connections += 1
+        logging.info("Connected to SMTP server %s:%s", self.host, self.port)
+
+    def _healthy(self):
+        if self.server is None:
+            return False
+        if time.time() - self.last_used < self.noop_interval:
+            return True
+        try:
+            code, _ = self.server.noop()
+        except (smtplib.SMTPException, OSError):
+            return False
+        return code == 250
+
+    def _reset(self):
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except (smtplib.SMTPException, OSError):
+            self.server.close()
+        self.server = None
+
+    def send(self, sender, recipients, message):
+        with self.lock:
+            if not self._healthy():
+                self._reset()
+                self._connect()
+            try:
+                self._transmit(sender, recipients, message)
+            except OSError as e:
+                if isinstance(e, smtplib.SMTPException) and not isinstance(e, smtplib.SMTPServerDisconnected):
+                    raise
+                logging.warning("SMTP connection lost (%s), reconnecting", e)
+                self._reset()
+                self._connect()
+                self._transmit(sender, recipients, message)
+            self.last_used = time.time()
+            self.messages_sent += 1
+
+    def _transmit(self, sender, recipients, message):
+        # sendmail() needs the whole message in memory; this feeds DATA from
+        # the StreamingMessage file instead.
+        server = self.server
+        recipients = [recipients] if isinstance(recipients, str) else list(recipients)
+        server.ehlo_or_helo_if_needed()
+        options = [f"SIZE={message.size}"] if server.has_extn('size') else []
+        code, reply = server.mail(sender, options)
+        if code != 250:
+            server.rset()
+            raise smtplib.SMTPSenderRefused(code, reply, sender)
+        for recipient in recipients:
+            code, reply = server.rcpt(recipient)
+            if code not in (250, 251):
+                server.rset()
+                raise smtplib.SMTPRecipientsRefused({recipient: (code, reply)})
+        code, reply = server.docmd('data')
+        if code != 354:
+            server.rset()
+            raise smtplib.SMTPDataError(code, reply)
+        for chunk in message.chunks():
+            server.send(chunk)
+        server.send(b".\r\n")
+        code, reply = server.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, reply)
+
+    def close(self):
+        with self.lock:
+            self._reset()
+
+def permanent_failure(error):
+    # 5xx replies (RFC 5321): the same message will be refused again.
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(500 <= code < 600 for code, _ in error.recipients.values())
+    return isinstance(error, smtplib.SMTPResponseException) and 500 <= error.smtp_code < 600
+
+# -----------------------------------------------------------------------------
+# Streaming Messages (built on disk, never held in memory as a whole)
+# -----------------------------------------------------------------------------
+# A multipart/mixed message written straight to a temporary file in SMTP wire
+# format (CRLF line ends, dot-stuffed). Attachments are base64-encoded from the
+# source file a chunk at a time, so peak memory stays around BASE64_CHUNK no
+# matter how big the clip is, and SMTPSession sends the file in chunks.
+BASE64_CHUNK = 57 * 1024
+
+class StreamingMessage:
+    def __init__(self, sender, to, subject):
+        self.subject = subject
+        self.boundary = f"=============={uuid.uuid4().hex}=="
+        self.file = tempfile.TemporaryFile()
+        self.size = 0
+        # alert id -> bytes left out of this message by the size budget
+        self.bytes_saved = {}
+        self.temp_paths = []
+        self._write_lines([
+            f"Subject: {subject if subject.isascii() else Header(subject, 'utf-8').encode(linesep=chr(13) + chr(10))}",
+            f"From: {sender}",
+            f"To: {to}",
+            f"Date: {email.utils.formatdate(localtime=True)}",
+            f"Message-ID: {email.utils.make_msgid()}",
+            "MIME-Version: 1.0",
+            f'Content-Type: multipart/mixed; boundary="{self.boundary}"',
+            ""
+        ])
+
+    def _write(self, data):
+        self.file.write(data)
+        self.size += len(data)
+
+    def _write_lines(self, lines):
+        for line in lines:
+            if line.startswith('.'):
+                line = '.' + line
+            self._write(line.encode('utf-8') + b"\r\n")
+
+    def _write_base64(self, stream):
+        # Whole 57-byte groups per chunk keep every line at 76 characters.
+        while True:
+            chunk = stream.read(BASE64_CHUNK)
+            if not chunk:
+                break
+            self._write(base64.encodebytes(chunk).replace(b"\n", b"\r\n"))
+
+    def _begin_part(self, content_type, filename=None, disposition='attachment'):
+        lines = [f"--{self.boundary}", f"Content-Type: {content_type}", "Content-Transfer-Encoding: base64"]
+        if filename:
+            lines.append(f'Content-Disposition: {disposition}; filename="{filename}"')
+        self._write_lines(lines + [""])
+
+    def add_text(self, text):
+        self._begin_part('text/plain; charset="utf-8"')
+        self._write_base64(io.BytesIO(text.encode('utf-8')))
+
+    def add_bytes(self, data, content_type, filename, disposition='attachment'):
+        self._begin_part(content_type, filename, disposition)
+        self._write_base64(io.BytesIO(data))
+
+    def add_file(self, path, content_type, filename=None):
+        self._begin_part(content_type, filename or os.path.basename(path))
+        with open(path, 'rb') as f:
+            self._write_base64(f)
+
+    def finish(self):
+        self._write_lines([f"--{self.boundary}--"])
+        return self
+
+    def chunks(self, size=64 * 1024):
+        self.file.seek(0)
+        while True:
+            chunk = self.file.read(size)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        self.file.close()
+        for path in self.temp_paths:
+            if os.path.exists(path):
+                os.remove(path)
+        self.temp_paths = []
+
+# -----------------------------------------------------------------------------
+# Clip Summaries (what gets attached when a clip is over the size budget)
+# -----------------------------------------------------------------------------
+CLIP_CONTENT_TYPES = {'.avi': 'video/x-msvideo', '.mp4': 'video/mp4'}
+OVERSIZE_CLIP_MODES = ('contact_sheet', 'downscale')
+
+def clip_frame_count(video_path, capture):
+    total = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    if total <= 0:
+        timestamps = read_clip_timestamps(video_path)
+        total = len(timestamps) if timestamps else 0
+    return total
+
+def make_contact_sheet(video_path, columns=4, rows=3, tile_width=320, quality=80):
+    # Evenly spaced keyframes tiled into one JPEG.
+    capture = cv2.VideoCapture(video_path)
+    total = clip_frame_count(video_path, capture)
+    tiles = []
+    if total > 0:
+        for index in np.linspace(0, total - 1, columns * rows).astype(int):
+            capture.set(cv2.CAP_PROP_POS_FRAMES, int(index))
+            ret, frame = capture.read()
+            if ret:
+                tiles.append(frame)
+    capture.release()
+    if not tiles:
+        return None
+    height, width = tiles[0].shape[:2]
+    tile_height = max(1, int(height * tile_width / width))
+    sheet = np.zeros((rows * tile_height, columns * tile_width, 3), dtype=np.uint8)
+    for index, tile in enumerate(tiles):
+        row, column = divmod(index, columns)
+        sheet[row * tile_height:(row + 1) * tile_height, column * tile_width:(column + 1) * tile_width] = \
+            cv2.resize(tile, (tile_width, tile_height), interpolation=cv2.INTER_AREA)
+    ok, encoded = cv2.imencode('.jpg', sheet, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return encoded.tobytes() if ok else None
+
+def downscale_clip(video_path, width=480):
+    # Re-encodes the clip with mp4v at `width` pixels wide into a temporary
+    # file, one frame at a time. Returns the file's path, or None.
+    capture = cv2.VideoCapture(video_path)
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    fps = fps if fps > 0 else 20.0
+    handle, out_path = tempfile.mkstemp(suffix='.mp4')
+    os.close(handle)
+    out = None
+    while True:
+        ret, frame = capture.read()
+        if not ret:
+            break
+        if out is None:
+            height = max(2, int(frame.shape[0] * width / frame.shape[1]) // 2 * 2)
+            out = cv2.VideoWriter(out_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+            if not out.isOpened():
+                break
+        out.write(cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA))
+    capture.release()
+    if out is None or not out.isOpened():
+        os.remove(out_path)
+        return None
+    out.release()
+    return out_path
+
+# -----------------------------------------------------------------------------
+# Alert Messages
+# -----------------------------------------------------------------------------
+# Alerts are the dicts queued by the alert dispatcher: id, to, subject, body,
+# video_path, image_path and created (a time.time() value). Clips larger than
+# `attachment_budget` bytes are replaced by a summary: a contact sheet of
+# keyframes, or with oversize='downscale' a smaller re-encode (which falls back
+# to the contact sheet if it is still over budget).
+def attach_clip(msg, alert, attachment_budget=None, oversize='contact_sheet'):
+    video_path = alert['video_path']
+    clip_size = os.path.getsize(video_path)
+    if attachment_budget is None or clip_size <= attachment_budget:
+        msg.add_file(video_path, CLIP_CONTENT_TYPES.get(os.path.splitext(video_path)[1], 'application/octet-stream'))
+        return
+    if oversize not in OVERSIZE_CLIP_MODES:
+        logging.warning("Unknown oversize clip mode %r, using contact_sheet", oversize)
+    name = os.path.splitext(os.path.basename(video_path))[0]
+    summary, attached = None, 0
+    if oversize == 'downscale':
+        small_path = downscale_clip(video_path)
+        if small_path is not None:
+            msg.temp_paths.append(small_path)
+            if os.path.getsize(small_path) <= attachment_budget:
+                attached = os.path.getsize(small_path)
+                msg.add_file(small_path, 'video/mp4', f"{name}_small.mp4")
+                summary = "downscaled clip"
+    if summary is None:
+        sheet = make_contact_sheet(video_path)
+        if sheet is not None:
+            attached = len(sheet)
+            msg.add_bytes(sheet, 'image/jpeg', f"{name}_contact_sheet.jpg")
+            summary = "contact sheet"
+    msg.bytes_saved[alert['id']] = clip_size - attached
+    logging.info("Clip %s is %.1f MB, over the %.1f MB budget: attached %s (%.1f MB saved)",
+                 os.path.basename(video_path), clip_size / 1e6, attachment_budget / 1e6,
+                 summary or "nothing", (clip_size - attached) / 1e6)
+
+def build_alert_message(sender, alert, attachment_budget=None, oversize='contact_sheet'):
+    msg = StreamingMessage(sender, alert['to'], alert['subject'])
+    try:
+        msg.add_text(alert['body'])
+        video_path = alert.get('video_path')
+        image_path = alert.get('image_path')
+        if video_path and os.path.exists(video_path):
+            attach_clip(msg, alert, attachment_budget, oversize)
+        if image_path and os.path.exists(image_path):
+            msg.add_file(image_path, 'image/jpeg')
+    except Exception:
+        msg.close()
+        raise
+    return msg.finish()
+
+def make_thumbnail(image_path, width=160, quality=70):
+    image = cv2.imread(image_path, cv2.IMREAD_REDUCED_COLOR_4)
+    if image is None:
+        return None
+    if image.shape[1] > width:
+        height = max(1, int(image.shape[0] * width / image.shape[1]))
+        image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+    ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return encoded.tobytes() if ok else None
+
+def build_digest_message(sender, alerts):
+    # One message for a batch of events: the list of events in the body and
+    # a small thumbnail per snapshot; the clips stay on disk.
+    first = alerts[0]
+    msg = StreamingMessage(sender, first['to'], f"{first['subject']} ({len(alerts)} events)")
+    try:
+        lines = [first['body'], "", f"{len(alerts)} motion events:"]
+        for alert in alerts:
+            clip = os.path.basename(alert['video_path']) if alert.get('video_path') else "no clip"
+            lines.append(f"  {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(alert['created']))}  {clip}")
+        msg.add_text("\n".join(lines))
+        for alert in alerts:
+            image_path = alert.get('image_path')
+            thumbnail = make_thumbnail(image_path) if image_path and os.path.exists(image_path) else None
+            if thumbnail is not None:
+                msg.add_bytes(thumbnail, 'image/jpeg', f"thumb_{os.path.basename(image_path)}", 'inline')
+            video_path = alert.get('video_path')
+            if video_path and os.path.exists(video_path):
+                msg.bytes_saved[alert['id']] = os.path.getsize(video_path)
+    except Exception:
+        msg.close()
+        raise
+    return msg.finish()
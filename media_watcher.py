@@ -0,0 +1,100 @@
+import os
+import logging
+import threading
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+# -----------------------------------------------------------------------------
+# Media Folder Watcher (created/deleted files in a Target folder)
+# -----------------------------------------------------------------------------
+# Calls on_created(path) / on_deleted(path) from a background thread for files
+# whose names end in one of `extensions`. Uses watchdog (inotify, FSEvents,
+# ReadDirectoryChangesW) when it is installed; otherwise it polls the folder's
+# mtime, which only changes when entries are added or removed, and lists the
+# folder only when it did.
+class _Handler(FileSystemEventHandler):
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.watcher._notify(self.watcher.on_created, event.src_path)
+
+    def on_deleted(self, event):
+        if not event.is_directory:
+            self.watcher._notify(self.watcher.on_deleted, event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.watcher._notify(self.watcher.on_deleted, event.src_path)
+            self.watcher._notify(self.watcher.on_created, event.dest_path)
+
+class MediaFolderWatcher:
+    def __init__(self, folder, extensions, on_created, on_deleted, poll_interval=2.0):
+        self.folder = folder
+        self.extensions = tuple(extensions)
+        self.on_created = on_created
+        self.on_deleted = on_deleted
+        self.poll_interval = poll_interval
+        self._observer = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _notify(self, callback, path):
+        if path.endswith(self.extensions):
+            try:
+                callback(path)
+            except Exception as e:
+                logging.error("Media watcher callback failed for %s: %s", path, e)
+
+    def start(self):
+        self._stop.clear()
+        if Observer is not None:
+            self._observer = Observer()
+            self._observer.schedule(_Handler(self), self.folder, recursive=False)
+            self._observer.daemon = True
+            self._observer.start()
+        else:
+            self._thread = threading.Thread(target=self._poll, daemon=True)
+            self._thread.start()
+        return self
+
+    def _listing(self):
+        return {name for name in os.listdir(self.folder) if name.endswith(self.extensions)}
+
+    def _poll(self):
+        try:
+            mtime = os.stat(self.folder).st_mtime_ns
+            known = self._listing()
+        except OSError as e:
+            logging.error("Cannot watch %s: %s", self.folder, e)
+            return
+        while not self._stop.wait(self.poll_interval):
+            try:
+                current_mtime = os.stat(self.folder).st_mtime_ns
+                if current_mtime == mtime:
+                    continue
+                mtime = current_mtime
+                current = self._listing()
+            except OSError:
+                continue
+            for name in sorted(known - current):
+                self._notify(self.on_deleted, os.path.join(self.folder, name))
+            for name in sorted(current - known):
+                self._notify(self.on_created, os.path.join(self.folder, name))
+            known = current
+
+    def stop(self):
+        self._stop.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join(timeout=2.0)
+            self._observer = None
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            self._thread = None
@@ -0,0 +1,1043 @@
+import cv2
+import numpy as np
+import threading
+import time
+import os
+import queue
+import logging
+import collections
+
+from clip_index import build_frame_index
+from event_index import open_event_index
+from thumbnail_cache import open_thumbnail_cache
+
+# -----------------------------------------------------------------------------
+# Threaded Frame Grabber (keeps network reads off the detection loop)
+# -----------------------------------------------------------------------------
+class FrameGrabber:
+    def __init__(self, source, buffer_size=4):
+        self.source = source
+        self.capture = cv2.VideoCapture(source)
+        # Bounded ring buffer: when full, appending drops the oldest frame.
+        self.frames = collections.deque(maxlen=max(1, int(buffer_size)))
+        self.condition = threading.Condition()
+        self.running = False
+        self.frames_read = 0
+        self.dropped_frames = 0
+        self._thread = None
+
+    def is_opened(self):
+        return self.capture.isOpened()
+
+    def start(self):
+        if self.capture.isOpened() and not self.running:
+            self.running = True
+            self._thread = threading.Thread(target=self._reader, daemon=True)
+            self._thread.start()
+        return self
+
+    def _reader(self):
+        # The capture is released here, once the read in progress returns, so
+        # release() never frees it under a blocked read.
+        try:
+            while self.running:
+                ret, frame = self.capture.read()
+                with self.condition:
+                    if not self.running:
+                        break
+                    if not ret:
+                        logging.error(f"Capture read failed for {self.source}")
+                        break
+                    if len(self.frames) == self.frames.maxlen:
+                        self.dropped_frames += 1
+                    self.frames.append(frame)
+                    self.frames_read += 1
+                    self.condition.notify()
+        finally:
+            self.capture.release()
+            with self.condition:
+                self.running = False
+                self.condition.notify_all()
+
+    @property
+    def queue_depth(self):
+        with self.condition:
+            return len(self.frames)
+
+    def read(self, timeout=2.0):
+        # Always hand out the freshest frame; anything older is stale and dropped.
+        # A stalled stream is waited out; (False, None) means the reader has
+        # stopped.
+        with self.condition:
+            stalled = False
+            while not self.frames and self.running:
+                if not self.condition.wait(timeout) and not stalled:
+                    logging.warning("No frame from %s for %.0fs, still waiting", self.source, timeout)
+                    stalled = True
+            if not self.frames:
+                return False, None
+            frame = self.frames.pop()
+            self.dropped_frames += len(self.frames)
+            self.frames.clear()
+            return True, frame
+
+    def stats(self):
+        with self.condition:
+            return {
+                'frames_read': self.frames_read,
+                'dropped_frames': self.dropped_frames,
+                'queue_depth': len(self.frames)
+            }
+
+    def stop(self):
+        # Wakes read() without waiting for the reader thread.
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+    def release(self):
+        self.stop()
+        if self._thread is None:
+            self.capture.release()
+        elif self._thread is not threading.current_thread():
+            self._thread.join(timeout=2.0)
+
+# -----------------------------------------------------------------------------
+# Preallocated Working Buffers
+# -----------------------------------------------------------------------------
+# One set of per-frame scratch images, reused through OpenCV's dst= outputs so a
+# steady stream does no full-frame allocations. Buffers are only rebuilt when
+# the stream resolution changes; `allocations` counts how often that happened.
+# Each frame is reduced to blurred grayscale once, into `current`; swap() then
+# keeps it as `previous` for the next frame's difference.
+# With an analysis width set, frames wider than it are converted to grayscale
+# at full size into `full_gray`, which is then shrunk into `gray`; resizing one
+# channel instead of three is the cheaper order. All other analysis buffers use
+# the smaller size; scale_x/scale_y map the analysis image back to the full
+# frame.
+class FrameBuffers:
+    def __init__(self):
+        self.shape = None
+        self.analysis_width = None
+        self.allocations = 0
+        self.primed = False
+
+    def ensure(self, shape, analysis_width=None):
+        if shape == self.shape and analysis_width == self.analysis_width:
+            return self
+        height, width = shape[:2]
+        if analysis_width and width > analysis_width:
+            small_width = int(analysis_width)
+            small_height = max(1, int(round(height * small_width / float(width))))
+            self.full_gray = np.empty((height, width), dtype=np.uint8)
+        else:
+            small_width, small_height = width, height
+            self.full_gray = None
+        self.size = (small_width, small_height)
+        self.scale_x = small_width / float(width)
+        self.scale_y = small_height / float(height)
+        self.gray = np.empty((small_height, small_width), dtype=np.uint8)
+        self.current = np.empty((small_height, small_width), dtype=np.uint8)
+        self.previous = np.empty((small_height, small_width), dtype=np.uint8)
+        self.diff = np.empty((small_height, small_width), dtype=np.uint8)
+        self.thresh = np.empty((small_height, small_width), dtype=np.uint8)
+        self.dilated = np.empty((small_height, small_width), dtype=np.uint8)
+        self.labels = np.empty((small_height, small_width), dtype=np.int32)
+        self.shape = shape
+        self.analysis_width = analysis_width
+        self.primed = False
+        self.allocations += 1
+        logging.debug("Allocated motion buffers for %dx%d (analysis at %dx%d)",
+                      width, height, small_width, small_height)
+        return self
+
+    def swap(self):
+        self.previous, self.current = self.current, self.previous
+        self.primed = True
+
+# -----------------------------------------------------------------------------
+# Blob Extractors
+# -----------------------------------------------------------------------------
+# Both take the binary motion mask and return an (N, 4) array of x, y, w, h
+# boxes for blobs of at least min_area pixels, in mask coordinates.
+def find_blobs_contours(mask, min_area, buffers=None):
+    # Only outer contours: the hierarchy was never used.
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    boxes = [cv2.boundingRect(contour) for contour in contours if cv2.contourArea(contour) >= min_area]
+    return np.array(boxes, dtype=np.int32).reshape(-1, 4)
+
+def find_blobs_components(mask, min_area, buffers=None):
+    # One C pass labels every blob; filtering and box extraction are then
+    # plain NumPy over the stats table, with no per-blob Python work. Areas
+    # are pixel counts, slightly larger than contour polygon areas.
+    labels = buffers.labels if buffers is not None else None
+    _, _, stats, _ = cv2.connectedComponentsWithStats(mask, labels=labels, connectivity=8)
+    stats = stats[1:]  # label 0 is the background
+    return stats[stats[:, cv2.CC_STAT_AREA] >= min_area, :4].astype(np.int32)
+
+BLOB_EXTRACTORS = {
+    'contours': find_blobs_contours,
+    'components': find_blobs_components
+}
+
+# -----------------------------------------------------------------------------
+# Zone Masks (include / exclude polygons)
+# -----------------------------------------------------------------------------
+# Zones are lists of dicts such as
+#   {"name": "driveway", "type": "include", "points": [[0.1, 0.5], [0.6, 0.5], ...]}
+# with points as fractions of the frame width/height, so they hold at any
+# resolution. They are rasterized once per analysis size into `mask`, applied
+# to each foreground mask with a single bitwise_and, and `labels` (one value per
+# include zone) lets score() get every zone's motion energy from one bincount.
+# Without include zones the whole frame counts, minus any exclude zones.
+class ZoneMask:
+    def __init__(self, zones):
+        self.zones = [zone for zone in zones or [] if len(zone.get('points', [])) >= 3]
+        self.include = [zone for zone in self.zones if zone.get('type', 'include') == 'include']
+        self.exclude = [zone for zone in self.zones if zone.get('type', 'include') == 'exclude']
+        self.names = [zone.get('name') or f"zone{index + 1}" for index, zone in enumerate(self.include)]
+        self.size = None
+
+    def __bool__(self):
+        return bool(self.zones)
+
+    @staticmethod
+    def _polygon(zone, width, height):
+        points = np.array(zone['points'], dtype=np.float32) * (width, height)
+        return np.rint(points).astype(np.int32).reshape(-1, 1, 2)
+
+    def ensure(self, size):
+        if size == self.size:
+            return self
+        width, height = size
+        self.mask = np.full((height, width), 0 if self.include else 255, dtype=np.uint8)
+        self.labels = np.zeros((height, width), dtype=np.uint8)
+        for index, zone in enumerate(self.include, 1):
+            polygon = self._polygon(zone, width, height)
+            cv2.fillPoly(self.mask, [polygon], 255)
+            cv2.fillPoly(self.labels, [polygon], index)
+        for zone in self.exclude:
+            polygon = self._polygon(zone, width, height)
+            cv2.fillPoly(self.mask, [polygon], 0)
+            cv2.fillPoly(self.labels, [polygon], 0)
+        self.pixels = np.bincount(self.labels.ravel(), minlength=len(self.include) + 1)
+        self.size = size
+        return self
+
+    def apply(self, foreground):
+        cv2.bitwise_and(foreground, self.mask, dst=foreground)
+
+    def score(self, foreground):
+        # Fraction of each include zone's pixels that are moving.
+        counts = np.bincount(self.labels[foreground != 0], minlength=len(self.include) + 1)
+        energy = counts[1:] / np.maximum(self.pixels[1:], 1)
+        return dict(zip(self.names, energy.tolist()))
+
+# -----------------------------------------------------------------------------
+# Quiet-Frame Fast Path (foreground pixel count)
+# -----------------------------------------------------------------------------
+# One cv2.countNonZero pass gives the frame's n foreground pixels. Dilation
+# turns each into at most a (1 + 2 * DILATE_ITERATIONS)-pixel square,
+# DILATE_GROWTH pixels, so no blob can cover more than n * DILATE_GROWTH pixels
+# wherever they sit. A blob built from m of those squares also spans at most m
+# squares each way, so an outer contour, which counts the holes it encloses,
+# can measure at most n**2 * DILATE_GROWTH. When the bound for the extractor in
+# use is under the minimum blob area, dilation plus blob extraction are skipped.
+DILATE_ITERATIONS = 2
+DILATE_GROWTH = (1 + 2 * DILATE_ITERATIONS) ** 2
+
+class QuietFrameCheck:
+    def __init__(self):
+        self.frames = 0
+        self.quiet_frames = 0
+
+    def is_quiet(self, foreground, min_area, contours=False):
+        pixels = cv2.countNonZero(foreground)
+        quiet = (pixels ** 2 if contours else pixels) * DILATE_GROWTH < min_area
+        self.frames += 1
+        if quiet:
+            self.quiet_frames += 1
+        return quiet
+
+# -----------------------------------------------------------------------------
+# Motion Backends (frame difference / background subtraction)
+# -----------------------------------------------------------------------------
+# A backend turns the blurred grayscale frame in buffers.current into a binary
+# foreground mask in buffers.thresh. mask() returns False while it has nothing
+# to compare against yet. buffers.primed goes False whenever the buffers are
+# rebuilt, which is the backend's cue to drop any state it holds.
+# process() also times each call so cameras can be tuned for accuracy vs CPU.
+DIFF_THRESHOLD = 25
+
+class MotionBackend:
+    name = None
+
+    def __init__(self):
+        self.frames = 0
+        self.total_time = 0.0
+        self.last_cost = 0.0
+
+    def process(self, buffers):
+        started = time.perf_counter()
+        ready = self.mask(buffers)
+        self.last_cost = time.perf_counter() - started
+        self.frames += 1
+        self.total_time += self.last_cost
+        return ready
+
+    @property
+    def average_cost_ms(self):
+        return 1000.0 * self.total_time / self.frames if self.frames else 0.0
+
+    def mask(self, buffers):
+        raise NotImplementedError
+
+class FrameDiffBackend(MotionBackend):
+    name = 'frame_diff'
+
+    def mask(self, buffers):
+        if not buffers.primed:
+            buffers.swap()
+            return False
+        cv2.absdiff(buffers.previous, buffers.current, dst=buffers.diff)
+        buffers.swap()
+        cv2.threshold(buffers.diff, DIFF_THRESHOLD, 255, cv2.THRESH_BINARY, dst=buffers.thresh)
+        return True
+
+class RunningAverageBackend(MotionBackend):
+    # Exponentially weighted background; catches slow movers that two-frame
+    # differencing misses, and averages away sensor noise.
+    name = 'running_average'
+
+    def __init__(self, alpha=0.05):
+        super().__init__()
+        self.alpha = alpha
+        self.background = None
+
+    def mask(self, buffers):
+        if not buffers.primed or self.background is None:
+            self.background = buffers.current.astype(np.float32)
+            buffers.primed = True
+            return False
+        cv2.convertScaleAbs(self.background, dst=buffers.diff)
+        cv2.absdiff(buffers.current, buffers.diff, dst=buffers.diff)
+        cv2.accumulateWeighted(buffers.current, self.background, self.alpha)
+        cv2.threshold(buffers.diff, DIFF_THRESHOLD, 255, cv2.THRESH_BINARY, dst=buffers.thresh)
+        return True
+
+class SubtractorBackend(MotionBackend):
+    # OpenCV's statistical background models (MOG2 / KNN). A fresh model marks
+    # most of the frame as foreground until it has seen a few frames (KNN for
+    # about four, MOG2 for one), so its first warmup_frames masks are not used.
+    def __init__(self, history=500, threshold=None, warmup_frames=5):
+        super().__init__()
+        self.history = history
+        self.threshold = threshold
+        self.warmup_frames = warmup_frames
+        self.subtractor = None
+        self.learned_frames = 0
+
+    def create(self):
+        raise NotImplementedError
+
+    def mask(self, buffers):
+        if not buffers.primed or self.subtractor is None:
+            self.subtractor = self.create()
+            self.learned_frames = 0
+            buffers.primed = True
+        self.subtractor.apply(buffers.current, fgmask=buffers.thresh)
+        self.learned_frames += 1
+        return self.learned_frames > self.warmup_frames
+
+class MOG2Backend(SubtractorBackend):
+    name = 'mog2'
+
+    def create(self):
+        return cv2.createBackgroundSubtractorMOG2(history=self.history,
+                                                  varThreshold=self.threshold or 16,
+                                                  detectShadows=False)
+
+class KNNBackend(SubtractorBackend):
+    name = 'knn'
+
+    def create(self):
+        return cv2.createBackgroundSubtractorKNN(history=self.history,
+                                                 dist2Threshold=self.threshold or 400.0,
+                                                 detectShadows=False)
+
+MOTION_BACKENDS = {
+    FrameDiffBackend.name: FrameDiffBackend,
+    RunningAverageBackend.name: RunningAverageBackend,
+    MOG2Backend.name: MOG2Backend,
+    KNNBackend.name: KNNBackend
+}
+
+def create_backend(name, options=None):
+    if name not in MOTION_BACKENDS:
+        logging.warning("Unknown motion backend %r, using frame_diff", name)
+        name = FrameDiffBackend.name
+    try:
+        return MOTION_BACKENDS[name](**(options or {}))
+    except TypeError as e:
+        logging.warning("Ignoring bad options %r for motion backend %s: %s", options, name, e)
+        return MOTION_BACKENDS[name]()
+
+# -----------------------------------------------------------------------------
+# Pre-Roll Buffer (the seconds before motion, JPEG-compressed)
+# -----------------------------------------------------------------------------
+# Keeps the last `seconds` of frames, each stored as JPEG bytes so a few
+# seconds of 1080p cost a few MB instead of hundreds. The ring is capped at
+# `max_frames` entries however fast the camera runs; memory_bytes reports
+# its current size so it can be tuned per camera.
+#
+# push() only hands the frame to an encoder thread, so JPEG encoding stays off
+# the detection loop. At most `max_pending` raw frames wait for it; when it
+# falls behind the oldest waiting frame is dropped. take() also returns frames
+# not encoded yet, as arrays, which decode() passes through unchanged.
+class PreRollBuffer:
+    def __init__(self, seconds=2.0, max_frames=150, quality=80, max_pending=4):
+        self.seconds = seconds
+        self.frames = collections.deque(maxlen=max(1, int(max_frames)))
+        self.params = [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+        self.memory_bytes = 0
+        self.pending = collections.deque()
+        self.max_pending = max(1, int(max_pending))
+        self.frames_dropped = 0
+        self.condition = threading.Condition()
+        self.encoding = None
+        self.generation = 0
+        self.running = False
+        self._thread = None
+
+    def start(self):
+        with self.condition:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self.running = True
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def push(self, frame, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        self.start()
+        with self.condition:
+            if len(self.pending) >= self.max_pending:
+                self.pending.popleft()
+                self.frames_dropped += 1
+            self.pending.append((timestamp, frame))
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                self.encoding = self.pending.popleft()
+                generation = self.generation
+            timestamp, frame = self.encoding
+            ok, encoded = cv2.imencode('.jpg', frame, self.params)
+            with self.condition:
+                self.encoding = None
+                if ok and generation == self.generation:
+                    self._append(timestamp, encoded.tobytes())
+
+    def _append(self, timestamp, data):
+        if len(self.frames) == self.frames.maxlen:
+            self.memory_bytes -= len(self.frames[0][1])
+        self.frames.append((timestamp, data))
+        self.memory_bytes += len(data)
+        while self.frames and timestamp - self.frames[0][0] > self.seconds:
+            self.memory_bytes -= len(self.frames.popleft()[1])
+
+    def take(self):
+        # Hands over the (timestamp, jpeg or frame) entries, oldest first, and
+        # leaves the ring empty; decoding is left to whoever writes them.
+        with self.condition:
+            entries = list(self.frames)
+            if self.encoding is not None:
+                entries.append(self.encoding)
+            entries.extend(self.pending)
+            self._clear()
+        if entries:
+            newest = entries[-1][0]
+            entries = [entry for entry in entries if newest - entry[0] <= self.seconds]
+        return entries
+
+    @staticmethod
+    def decode(data):
+        if isinstance(data, np.ndarray):
+            return data
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+    def _clear(self):
+        # Frames already being encoded are discarded when they finish.
+        self.frames.clear()
+        self.pending.clear()
+        self.encoding = None
+        self.generation += 1
+        self.memory_bytes = 0
+
+    def clear(self):
+        with self.condition:
+            self._clear()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self._clear()
+            self.condition.notify()
+            thread, self._thread = self._thread, None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=2.0)
+
+    def __len__(self):
+        return len(self.frames)
+
+# -----------------------------------------------------------------------------
+# Recording Formats
+# -----------------------------------------------------------------------------
+# Codec -> container. MJPG is the most portable but several times larger than
+# the MPEG-4 codecs. Quality (0-100) is applied through VIDEOWRITER_PROP_QUALITY,
+# which MJPG honours and the other encoders ignore. Each clip gets a sidecar of
+# per-frame capture timestamps (one per line), so players can show real time
+# even when the writer had to drop frames.
+RECORD_CODECS = {'MJPG': '.avi', 'XVID': '.avi', 'mp4v': '.mp4'}
+VIDEO_EXTENSIONS = ('.avi', '.mp4')
+DEFAULT_RECORD_FPS = 20.0
+
+def clip_timestamps_path(video_path):
+    return os.path.splitext(video_path)[0] + '.timestamps'
+
+def read_clip_timestamps(video_path):
+    path = clip_timestamps_path(video_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as file:
+            return [float(line) for line in file if line.strip()]
+    except (OSError, ValueError) as e:
+        logging.warning(f"Could not read frame timestamps {path}: {e}")
+        return None
+
+# -----------------------------------------------------------------------------
+# Clip Writer (encodes clips and snapshots off the detection thread)
+# -----------------------------------------------------------------------------
+# The detector queues work; one writer thread owns the VideoWriter, so slow
+# SD cards or NAS mounts back up this queue instead of stalling analysis.
+# Clip open/close and snapshots are never dropped. When the queue is full,
+# frames follow `policy`:
+#   'block'       wait for room (no frame loss, detection slows down)
+#   'drop'        drop the frame
+#   'reduce_fps'  keep only every Nth frame, doubling N each time the queue
+#                 fills and halving it again once the queue drains
+RECORD_POLICIES = ('block', 'drop', 'reduce_fps')
+
+class ClipWriter:
+    def __init__(self, max_queue=120, policy='block', name=None):
+        if policy not in RECORD_POLICIES:
+            logging.warning("Unknown record queue policy %r, using block", policy)
+            policy = 'block'
+        self.policy = policy
+        self.name = name
+        self.jobs = queue.Queue(maxsize=max(1, int(max_queue)))
+        self.out = None
+        self.path = None
+        self.fourcc = None
+        self.timestamps = None
+        self.decimation = 1
+        self._counter = 0
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.write_latency = 0.0
+        self.max_write_latency = 0.0
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name=f"clip-writer-{self.name}", daemon=True)
+            self._thread.start()
+        return self
+
+    def _put(self, job):
+        # Control jobs wait for room, but never forever on a dead writer.
+        while True:
+            try:
+                self.jobs.put(job, timeout=1.0)
+                return True
+            except queue.Full:
+                if self._thread is None or not self._thread.is_alive():
+                    logging.error("Clip writer %s is not running, dropping %s job", self.name, job[0])
+                    return False
+
+    def open_clip(self, path, fourcc, fps, size, pre_roll=None, quality=None):
+        self.start()
+        self.decimation = 1
+        self._counter = 0
+        self._put(('open', time.time(), path, fourcc, fps, size, pre_roll or [], quality))
+
+    def write(self, frame, timestamp=None):
+        queued = time.time()
+        job = ('frame', queued, frame, queued if timestamp is None else timestamp)
+        if self.policy == 'block':
+            return self._put(job)
+        self._counter += 1
+        if self._counter % self.decimation:
+            self.frames_dropped += 1
+            return False
+        try:
+            self.jobs.put_nowait(job)
+        except queue.Full:
+            self.frames_dropped += 1
+            if self.policy == 'reduce_fps':
+                self.decimation = min(self.decimation * 2, 16)
+            return False
+        if self.decimation > 1 and self.jobs.qsize() < self.jobs.maxsize // 4:
+            self.decimation //= 2
+        return True
+
+    def snapshot(self, path, frame, thumbnails=()):
+        # thumbnails: media files (the snapshot, its clip) previewed by this frame.
+        self.start()
+        self._put(('snapshot', time.time(), path, frame, thumbnails))
+
+    def close_clip(self, on_closed=None):
+        # on_closed(path) runs on the writer thread once the file is complete.
+        self._put(('close', time.time(), on_closed))
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            kind, queued = job[0], job[1]
+            try:
+                if kind == 'stop':
+                    return
+                elif kind == 'open':
+                    self._open(*job[2:])
+                elif kind == 'frame':
+                    if self.out is not None:
+                        self.out.write(job[2])
+                        self._stamp(job[3])
+                        self.frames_written += 1
+                        latency = time.time() - queued
+                        self.write_latency = 0.9 * self.write_latency + 0.1 * latency
+                        self.max_write_latency = max(self.max_write_latency, latency)
+                elif kind == 'snapshot':
+                    if not cv2.imwrite(job[2], job[3]):
+                        logging.error(f"Failed to write snapshot {job[2]}")
+                    for media_path in job[4]:
+                        open_thumbnail_cache(os.path.dirname(media_path)).put_frame(media_path, job[3])
+                elif kind == 'close':
+                    path = self.path
+                    self._close()
+                    if job[2] is not None and path is not None:
+                        job[2](path)
+            except Exception as e:
+                logging.error("Clip writer %s failed on %s job: %s", self.name, kind, e)
+            finally:
+                self.jobs.task_done()
+
+    def _open(self, path, fourcc, fps, size, pre_roll, quality):
+        self._close()
+        self.out = cv2.VideoWriter(path, fourcc, fps, size)
+        self.path = path
+        self.fourcc = fourcc
+        if not self.out.isOpened():
+            logging.error(f"Failed to initialize VideoWriter for {path}")
+            self.out = None
+            return
+        if quality is not None:
+            self.out.set(cv2.VIDEOWRITER_PROP_QUALITY, float(quality))
+        try:
+            self.timestamps = open(clip_timestamps_path(path), 'w')
+        except OSError as e:
+            logging.warning(f"Could not create frame timestamps for {path}: {e}")
+        flushed = 0
+        for timestamp, data in pre_roll:
+            frame = PreRollBuffer.decode(data)
+            if frame is not None and (frame.shape[1], frame.shape[0]) == tuple(size):
+                self.out.write(frame)
+                self._stamp(timestamp)
+                flushed += 1
+        if pre_roll:
+            logging.info(f"Wrote {flushed} pre-roll frames to {path}")
+
+    def _stamp(self, timestamp):
+        if self.timestamps is not None:
+            self.timestamps.write(f"{timestamp:.6f}\n")
+
+    def _close(self):
+        if self.out is not None:
+            self.out.release()
+            # MJPG clips get their frame index now, while the file is still
+            # in the page cache, so the player can seek them straight away.
+            if self.fourcc == cv2.VideoWriter_fourcc(*'MJPG'):
+                build_frame_index(self.path)
+        self.out = None
+        if self.timestamps is not None:
+            self.timestamps.close()
+        self.timestamps = None
+
+    def stats(self):
+        return {
+            'record_queue_depth': self.jobs.qsize(),
+            'record_frames_written': self.frames_written,
+            'record_frames_dropped': self.frames_dropped,
+            'record_latency_ms': self.write_latency * 1000.0,
+            'record_max_latency_ms': self.max_write_latency * 1000.0,
+            'record_decimation': self.decimation
+        }
+
+    def stop(self, timeout=10.0):
+        # Finishes everything already queued, then ends the thread.
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._put(('stop', time.time()))
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logging.warning("Clip writer %s still busy after %.0fs", self.name, timeout)
+
+# -----------------------------------------------------------------------------
+# Motion Detector Engine
+# -----------------------------------------------------------------------------
+# config.json / camera definition key -> MotionDetector keyword argument
+DETECTOR_CONFIG_KEYS = {
+    'sensitivity': 'sensitivity',
+    'capture_buffer_size': 'buffer_size',
+    'analysis_width': 'analysis_width',
+    'blob_extractor': 'blob_extractor',
+    'motion_backend': 'backend',
+    'backend_options': 'backend_options',
+    'zones': 'zones',
+    'quiet_fast_path': 'quiet_fast_path',
+    'pre_roll_seconds': 'pre_roll_seconds',
+    'pre_roll_max_frames': 'pre_roll_max_frames',
+    'pre_roll_quality': 'pre_roll_quality',
+    'confirm_frames': 'confirm_frames',
+    'min_on_seconds': 'min_on_seconds',
+    'post_roll_seconds': 'post_roll_seconds',
+    'record_queue_size': 'record_queue_size',
+    'record_queue_policy': 'record_queue_policy',
+    'record_codec': 'record_codec',
+    'record_quality': 'record_quality',
+    'record_fps': 'record_fps',
+    'record_events': 'record_events'
+}
+
+def detector_options(settings):
+    return {arg: settings[key] for key, arg in DETECTOR_CONFIG_KEYS.items() if key in settings}
+
+# Every piece of pipeline state lives on the instance, so several detectors can
+# run side by side in one process. The UI (or a test/benchmark) plugs in through
+# the on_* hooks, which are all called as hook(detector, ...) from the detection
+# thread unless noted:
+#   on_status(detector, state)            state: 'no_motion', 'motion', 'stopped'
+#   on_motion_start(detector, video_path, image_path)
+#   on_motion_end(detector, video_path, image_path)  (from the clip writer thread)
+#   on_frame(detector, frame)             annotated frame, e.g. for a preview
+#   on_error(detector, title, message)
+class MotionDetector:
+    def __init__(self, source, target_folder, sensitivity=500, buffer_size=4, analysis_width=320,
+                 blob_extractor='contours', backend='frame_diff', backend_options=None, zones=None,
+                 quiet_fast_path=True, pre_roll_seconds=2.0, pre_roll_max_frames=150,
+                 pre_roll_quality=80, confirm_frames=3, min_on_seconds=3.0, post_roll_seconds=5.0,
+                 record_queue_size=120, record_queue_policy='block', record_codec='MJPG', record_quality=None,
+                 record_fps=None, record_events=True, name=None, on_status=None, on_motion_start=None, on_motion_end=None,
+                 on_frame=None, on_error=None):
+        self.source = source
+        self.name = name
+        self.target_folder = target_folder
+        # Minimum contour area, always in full-resolution pixels.
+        self.sensitivity = sensitivity
+        self.buffer_size = buffer_size
+        # Analysis runs on frames shrunk to this width; None or 0 keeps full size.
+        self.analysis_width = analysis_width
+        if blob_extractor not in BLOB_EXTRACTORS:
+            logging.warning("Unknown blob extractor %r, using contours", blob_extractor)
+            blob_extractor = 'contours'
+        self.find_blobs = BLOB_EXTRACTORS[blob_extractor]
+        self.backend = create_backend(backend, backend_options)
+        self.zone_mask = ZoneMask(zones)
+        self.zone_scores = {}
+        self.quiet_check = QuietFrameCheck() if quiet_fast_path else None
+        self.pre_roll = PreRollBuffer(pre_roll_seconds, pre_roll_max_frames, pre_roll_quality) if pre_roll_seconds else None
+        # Recording state machine: a clip starts after `confirm_frames`
+        # consecutive motion frames, and ends once there has been no motion for
+        # `post_roll_seconds` and it has run for at least `min_on_seconds`.
+        # Motion inside the post-roll window just extends the current clip.
+        self.confirm_frames = max(1, int(confirm_frames))
+        self.min_on_seconds = min_on_seconds
+        self.post_roll_seconds = post_roll_seconds
+        self.motion_streak = 0
+        self.last_motion_time = 0.0
+        self.record_started = 0.0
+        # Each clip is added to the Target folder's event index as it starts
+        # and completed there once it is closed.
+        self.record_events = record_events
+        self.event_start = 0.0
+        self.peak_area = 0
+        self.on_status = on_status
+        self.on_motion_start = on_motion_start
+        self.on_motion_end = on_motion_end
+        self.on_frame = on_frame
+        self.on_error = on_error
+        self.grabber = None
+        self.motion_detected = False
+        self.recording = False
+        self.stop_requested = False
+        if record_codec not in RECORD_CODECS:
+            logging.warning("Unknown record codec %r, using MJPG", record_codec)
+            record_codec = 'MJPG'
+        self.record_codec = record_codec
+        self.fourcc = cv2.VideoWriter_fourcc(*record_codec)
+        self.record_quality = record_quality
+        # Clips are written at the measured frame rate unless record_fps is set.
+        self.record_fps = record_fps
+        self.frame_interval = 0.0
+        self._last_frame_time = None
+        self.recorder = ClipWriter(record_queue_size, record_queue_policy, name=name or source)
+        self.video_path = None
+        self.image_path = None
+        self.buffers = FrameBuffers()
+        self.frames_processed = 0
+        self._stats_mark = (time.time(), 0)
+        self._thread = None
+
+    def _emit(self, hook, *args):
+        if hook is None:
+            return
+        try:
+            hook(self, *args)
+        except Exception as e:
+            logging.error("Motion detector hook %s failed: %s", getattr(hook, '__name__', hook), e)
+
+    def open(self):
+        self.grabber = FrameGrabber(self.source, buffer_size=self.buffer_size)
+        if not self.grabber.is_opened():
+            logging.error(f"Failed to open video capture with IP: {self.source}")
+            self._emit(self.on_error, "Camera Error", f"Unable to access video stream at {self.source}")
+            self.grabber.release()
+            self.grabber = None
+            return False
+        self.grabber.start()
+        ret, frame = self.grabber.read()
+        if not ret:
+            logging.error("Failed to read initial frame from video stream.")
+            self.grabber.release()
+            self.grabber = None
+            return False
+        return self.step(frame)
+
+    def step(self, frame=None, timestamp=None):
+        # Processes one frame (read from the grabber unless given) and returns
+        # False once the stream has ended. `timestamp` defaults to now.
+        now = time.time() if timestamp is None else timestamp
+        if frame is None:
+            if self.grabber is None or not self.grabber.running:
+                return False
+            ret, frame = self.grabber.read()
+            if not ret:
+                if not self.stop_requested:
+                    logging.error("Failed to read frame during motion detection.")
+                return False
+        if self._last_frame_time is not None and now > self._last_frame_time:
+            interval = now - self._last_frame_time
+            self.frame_interval = 0.9 * self.frame_interval + 0.1 * interval if self.frame_interval else interval
+        self._last_frame_time = now
+        # The BGR frame is only used for drawing and recording from here on.
+        buffers = self.buffers.ensure(frame.shape, self.analysis_width)
+        if buffers.full_gray is not None:
+            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=buffers.full_gray)
+            cv2.resize(buffers.full_gray, buffers.size, dst=buffers.gray, interpolation=cv2.INTER_AREA)
+        else:
+            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=buffers.gray)
+        cv2.GaussianBlur(buffers.gray, (5, 5), 0, dst=buffers.current)
+        if not self.backend.process(buffers):
+            # First frames, or the stream changed resolution: no usable mask yet.
+            return True
+        zone_mask = self.zone_mask
+        if zone_mask:
+            zone_mask.ensure(buffers.size).apply(buffers.thresh)
+            if zone_mask.include:
+                self.zone_scores = zone_mask.score(buffers.thresh)
+
+        # Scale the threshold so configured sensitivities keep their meaning.
+        min_area = self.sensitivity * buffers.scale_x * buffers.scale_y
+        if self.quiet_check is not None and self.quiet_check.is_quiet(
+                buffers.thresh, min_area, contours=self.find_blobs is find_blobs_contours):
+            boxes = np.empty((0, 4), dtype=np.int32)
+        else:
+            cv2.dilate(buffers.thresh, None, dst=buffers.dilated, iterations=DILATE_ITERATIONS)
+            boxes = self.find_blobs(buffers.dilated, min_area, buffers)
+        motion_in_zone = len(boxes) > 0
+        if motion_in_zone and buffers.full_gray is not None:
+            scale = np.array([buffers.scale_x, buffers.scale_y, buffers.scale_x, buffers.scale_y])
+            boxes = np.rint(boxes / scale).astype(np.int32)
+        for (x, y, w, h) in boxes.tolist():
+            cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
+
+        if motion_in_zone:
+            self.motion_streak += 1
+            self.last_motion_time = now
+            if self.recording:
+                self.peak_area = max(self.peak_area, int((boxes[:, 2] * boxes[:, 3]).sum()))
+        else:
+            self.motion_streak = 0
+        if not self.recording:
+            if self.motion_streak >= self.confirm_frames:
+                self._start_recording(frame, now)
+                self.peak_area = int((boxes[:, 2] * boxes[:, 3]).sum())
+        elif (not motion_in_zone and now - self.last_motion_time >= self.post_roll_seconds
+              and now - self.record_started >= self.min_on_seconds):
+            self._stop_recording()
+        if self.recording:
+            self.recorder.write(frame, now)
+        elif self.pre_roll is not None:
+            self.pre_roll.push(frame, now)
+
+        self._emit(self.on_frame, frame)
+        self.frames_processed += 1
+        return True
+
+    def _start_recording(self, frame, now):
+        self.motion_detected = True
+        self.recording = True
+        self.record_started = now
+        timestamp = time.strftime("%Y%m%d-%H%M%S")
+        if self.name:
+            # Several cameras share one Target folder, so keep their files apart.
+            timestamp = f"{self.name}_{timestamp}"
+        if not os.path.exists(self.target_folder):
+            os.makedirs(self.target_folder)
+        self.video_path = os.path.join(self.target_folder, f'motion_{timestamp}{RECORD_CODECS[self.record_codec]}')
+        self.image_path = os.path.join(self.target_folder, f'image_{timestamp}.jpg')
+        fps = self.record_fps or self.capture_fps() or DEFAULT_RECORD_FPS
+        fps = round(min(max(fps, 1.0), 120.0), 2)
+        pre_roll = self.pre_roll.take() if self.pre_roll is not None else None
+        self.event_start = pre_roll[0][0] if pre_roll else now
+        self.recorder.open_clip(self.video_path, self.fourcc, fps, (frame.shape[1], frame.shape[0]),
+                                pre_roll=pre_roll, quality=self.record_quality)
+        self.recorder.snapshot(self.image_path, frame,
+                               thumbnails=(self.image_path, self.video_path) if self.record_events else ())
+        self._index_event('add_event', self.video_path, self.image_path, self.event_start, camera=self.name)
+        self._emit(self.on_motion_start, self.video_path, self.image_path)
+        self._emit(self.on_status, 'motion')
+        print(f"Started recording to {self.video_path}")
+        logging.info(f"Started recording to {self.video_path} ({self.record_codec}, {fps} FPS)")
+
+    def _stop_recording(self, notify=True):
+        was_recording = self.recording
+        self.motion_detected = False
+        self.recording = False
+        if was_recording:
+            image_path = self.image_path
+            end, peak_area = self._last_frame_time or time.time(), self.peak_area
+            def clip_closed(video_path):
+                # Runs on the writer thread, once the file is complete.
+                if os.path.exists(video_path) and os.path.getsize(video_path) > 0:
+                    self._index_event('finish_event', video_path, end, peak_area=peak_area,
+                                      size=os.path.getsize(video_path))
+                    if notify:
+                        self._emit(self.on_motion_end, video_path, image_path)
+                else:
+                    logging.error(f"Video file {video_path} is empty or not created.")
+                    # The snapshot stays listed on its own.
+                    self._index_event('remove_media', video_path)
+            self.recorder.close_clip(clip_closed)
+        self.video_path = None
+        self.image_path = None
+        if notify:
+            self._emit(self.on_status, 'no_motion')
+            print("Stopped recording...")
+            logging.info("Stopped recording")
+
+    def _index_event(self, method, video_path, *args, **kwargs):
+        if not self.record_events:
+            return
+        try:
+            getattr(open_event_index(self.target_folder), method)(video_path, *args, **kwargs)
+        except Exception as e:
+            logging.error(f"Could not update {video_path} in the event index: {e}")
+
+    def capture_fps(self):
+        # Smoothed rate at which frames reach step(), i.e. the rate clips are fed.
+        return 1.0 / self.frame_interval if self.frame_interval else 0.0
+
+    def set_zones(self, zones):
+        # Safe while running: the next frame picks up the new mask.
+        self.zone_mask = ZoneMask(zones)
+        self.zone_scores = {}
+
+    def stats(self):
+        # Rates cover the time since the previous stats() call.
+        now = time.time()
+        since, frames = self._stats_mark
+        self._stats_mark = (now, self.frames_processed)
+        stats = {
+            'fps': (self.frames_processed - frames) / (now - since) if now > since else 0.0,
+            'frames_processed': self.frames_processed,
+            'capture_fps': self.capture_fps(),
+            'backend': self.backend.name,
+            'backend_ms': self.backend.average_cost_ms,
+            'backend_last_ms': self.backend.last_cost * 1000.0,
+            'zones': dict(self.zone_scores)
+        }
+        stats.update(self.recorder.stats())
+        if self.pre_roll is not None:
+            stats['pre_roll_frames'] = len(self.pre_roll)
+            stats['pre_roll_bytes'] = self.pre_roll.memory_bytes
+            stats['pre_roll_dropped'] = self.pre_roll.frames_dropped
+        if self.quiet_check is not None:
+            stats['fast_path_frames'] = self.quiet_check.quiet_frames
+            stats['fast_path_ratio'] = self.quiet_check.quiet_frames / max(1, self.quiet_check.frames)
+        if self.grabber is not None:
+            stats.update(self.grabber.stats())
+        return stats
+
+    def run(self):
+        if self.grabber is None and not self.open():
+            return
+        try:
+            while not self.stop_requested and self.step():
+                pass
+        finally:
+            self.close()
+
+    def start(self):
+        if self.is_running():
+            return self
+        self.stop_requested = False
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.stop_requested = True
+        grabber = self.grabber
+        if grabber is not None:
+            grabber.stop()
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def join(self, timeout=None):
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def close(self):
+        if self.grabber is not None:
+            stats = self.grabber.stats()
+            logging.info("Capture stats for %s: %d frames read, %d dropped, queue depth %d",
+                         self.source, stats['frames_read'], stats['dropped_frames'], stats['queue_depth'])
+            self.grabber.release()
+            self.grabber = None
+        # A clip cut short by stopping detection is kept but not mailed.
+        self._stop_recording(notify=False)
+        self.recorder.stop()
+        if self.pre_roll is not None:
+            self.pre_roll.stop()
+        self.buffers.primed = False
+        self.motion_streak = 0
+        self._last_frame_time = None
+        self._emit(self.on_status, 'stopped')
@@ -0,0 +1,46 @@
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from motion_engine import MotionDetector
+
+def synthetic_frames(count=12, width=640, height=480):
+    # A still grey scene, then a white block sliding across it.
+    frames = []
+    for index in range(count):
+        frame = np.full((height, width, 3), 90, dtype=np.uint8)
+        if index >= 3:
+            x = 40 + (index - 3) * 30
+            frame[150:300, x:x + 120] = 255
+        frames.append(frame)
+    return frames
+
+class MotionDetectorStepTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def run_frames(self, **options):
+        detector = MotionDetector(None, self.folder, sensitivity=500, **options)
+        try:
+            for frame in synthetic_frames():
+                self.assertTrue(detector.step(frame))
+            return detector.motion_detected
+        finally:
+            detector.close()
+
+    def test_contours(self):
+        self.assertTrue(self.run_frames(blob_extractor='contours'))
+
+    def test_components(self):
+        self.assertTrue(self.run_frames(blob_extractor='components'))
+
+    def test_full_resolution(self):
+        self.assertTrue(self.run_frames(analysis_width=0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,201 @@
+import os
+import struct
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+# -----------------------------------------------------------------------------
+# Thumbnail Cache (small JPEG previews of clips and snapshots, on disk)
+# -----------------------------------------------------------------------------
+# Thumbnails live in `<Target folder>/.thumbnails`, one `<media file>.jpg` per
+# clip or snapshot. The recorder writes them from the frame it snapshots when a
+# recording starts; anything older is made on first request by a small worker
+# pool. The folder is kept under `max_bytes`: once the running total passes it,
+# the least recently used thumbnails (oldest mtime; get() touches a hit) are
+# deleted down to 90% of the budget. Cameras in other processes write to the
+# same folder, so eviction always works from a fresh listing.
+THUMBNAIL_FOLDER = '.thumbnails'
+THUMBNAIL_SIZE = (160, 120)
+
+# cv2 flags for decoding a JPEG at 1/1, 1/2, 1/4 and 1/8 scale.
+REDUCED_FLAGS = ((1, cv2.IMREAD_COLOR), (2, cv2.IMREAD_REDUCED_COLOR_2),
+                 (4, cv2.IMREAD_REDUCED_COLOR_4), (8, cv2.IMREAD_REDUCED_COLOR_8))
+
+def jpeg_size(path):
+    # (width, height) from the JPEG's SOF header, without decoding it.
+    try:
+        with open(path, 'rb') as f:
+            if f.read(2) != b'\xff\xd8':
+                return None
+            while True:
+                marker = f.read(2)
+                if len(marker) < 2 or marker[0] != 0xFF:
+                    return None
+                length = struct.unpack('>H', f.read(2))[0]
+                if 0xC0 <= marker[1] <= 0xCF and marker[1] not in (0xC4, 0xC8, 0xCC):
+                    height, width = struct.unpack('>xHH', f.read(5))
+                    return width, height
+                f.seek(length - 2, os.SEEK_CUR)
+    except (OSError, struct.error):
+        return None
+
+def read_reduced(path, max_width, max_height):
+    # Decode at the smallest 1/2^n scale that still covers max_width x max_height;
+    # libjpeg skips the detail it would otherwise decode only to throw away.
+    size = jpeg_size(path)
+    flag = cv2.IMREAD_COLOR
+    if size is not None:
+        for scale, reduced in REDUCED_FLAGS:
+            if size[0] / scale >= max_width or size[1] / scale >= max_height:
+                flag = reduced
+    return cv2.imread(path, flag)
+
+def fit_frame(frame, size):
+    height, width = frame.shape[:2]
+    scale = min(size[0] / width, size[1] / height, 1.0)
+    if scale >= 1.0:
+        return frame
+    return cv2.resize(frame, (max(1, int(width * scale)), max(1, int(height * scale))),
+                      interpolation=cv2.INTER_AREA)
+
+class ThumbnailCache:
+    def __init__(self, folder, max_bytes=32 * 1024 * 1024, size=THUMBNAIL_SIZE, workers=2):
+        self.folder = os.path.join(folder, THUMBNAIL_FOLDER)
+        self.max_bytes = max_bytes
+        self.size = size
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.executor = None
+        self.workers = workers
+        os.makedirs(self.folder, exist_ok=True)
+        self.bytes = self._usage()
+
+    def thumbnail_path(self, media_path):
+        return os.path.join(self.folder, os.path.basename(media_path) + '.jpg')
+
+    def get(self, media_path):
+        path = self.thumbnail_path(media_path)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def put_frame(self, media_path, frame):
+        path = self.thumbnail_path(media_path)
+        thumbnail = fit_frame(frame, self.size)
+        if not cv2.imwrite(path, thumbnail, [cv2.IMWRITE_JPEG_QUALITY, 80]):
+            logging.warning(f"Could not write thumbnail {path}")
+            return None
+        with self.lock:
+            self.bytes += os.path.getsize(path)
+            over = self.bytes > self.max_bytes
+        if over:
+            self.evict()
+        return path
+
+    def make(self, media_path):
+        if media_path.lower().endswith('.jpg'):
+            frame = read_reduced(media_path, *self.size)
+        else:
+            capture = cv2.VideoCapture(media_path)
+            ret, frame = capture.read()
+            capture.release()
+            frame = frame if ret else None
+        if frame is None:
+            logging.warning(f"Could not read {media_path} for a thumbnail")
+            return None
+        return self.put_frame(media_path, frame)
+
+    def request(self, media_path, callback):
+        # Returns the thumbnail if it exists; otherwise one is made in the pool
+        # and callback(media_path, thumbnail_path) runs on a worker thread.
+        path = self.get(media_path)
+        if path is not None:
+            return path
+        with self.lock:
+            if media_path in self.pending:
+                return None
+            self.pending.add(media_path)
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='thumbnails')
+            self.executor.submit(self._make_for, media_path, callback)
+        return None
+
+    def _make_for(self, media_path, callback):
+        try:
+            path = self.make(media_path) if os.path.exists(media_path) else None
+            if path is not None:
+                callback(media_path, path)
+        except Exception as e:
+            logging.error("Thumbnail for %s failed: %s", media_path, e)
+        finally:
+            with self.lock:
+                self.pending.discard(media_path)
+
+    def discard(self, media_path):
+        path = self.thumbnail_path(media_path)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self.lock:
+            self.bytes -= size
+
+    def _usage(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.folder):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self):
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        removed = 0
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        with self.lock:
+            self.bytes = total
+        if removed:
+            logging.info("Evicted %d thumbnails from %s", removed, self.folder)
+
+    def close(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+# One cache per Target folder per process.
+_caches = {}
+_caches_lock = threading.Lock()
+
+def open_thumbnail_cache(folder):
+    key = os.path.abspath(folder)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = ThumbnailCache(folder)
+        return _caches[key]
+
+def close_thumbnail_caches():
+    with _caches_lock:
+        for cache in _caches.values():
+            cache.close()
+        _caches.clear()